@@ -0,0 +1,302 @@
+#!/usr/bin/env python
+
+"""Benchmark knowtator2oa.py on synthetic Knowtator XML corpora."""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import codecs
+import tempfile
+import subprocess
+import resource
+import multiprocessing
+import xml.etree.ElementTree as ET
+
+import knowtator2oa as k2oa
+
+# Annotation sizes (number of annotations per document) to benchmark
+DEFAULT_SIZES = [1000, 10000, 100000]
+
+# Ontologies to draw synthetic annotations from: (class ID, slots)
+# generators, where slots are (tag, slot ID, value) triples.
+ontologies = {
+    'chebi': lambda r: ('CHEBI:%d' % r.randint(1, 60000), []),
+    'cl': lambda r: ('CL:%07d' % r.randint(1, 3000), []),
+    'go': lambda r: ('GO:%07d' % r.randint(1, 80000), []),
+    'pr': lambda r: ('PR:%09d' % r.randint(1, 100000), []),
+    'so': lambda r: ('SO:%07d' % r.randint(1, 2000), []),
+    'ncbitaxon': lambda r: ('organism', [
+        (k2oa.t_intslot, 'taxonomy ID', str(r.randint(1, 2000000))),
+        (k2oa.t_boolslot, 'taxon ambiguity', 'false'),
+        (k2oa.t_strslot, 'common name', '[mouse, mice]'),
+    ]),
+    'entrezgene': lambda r: ('Entrez Gene sequence', [
+        (k2oa.t_intslot, 'has Entrez Gene ID', str(r.randint(1, 100000))),
+    ]),
+    'typography': lambda r: (r.choice(['bold', 'italic', 'sub', 'sup']), []),
+}
+
+# Slot added to mentions by --slot-density; relevant, so it is converted
+# into a (mapped) body, giving slot-derived and multiple-valued bodies
+EXTRA_SLOT = (k2oa.t_cmpxslot, 'has Entrez Gene ID', '12345')
+
+PHASES = ['parse', 'text', 'validate', 'convert', 'create_id', 'serialize']
+
+K2OA_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           'knowtator2oa.py')
+
+def argparser():
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__)
+
+    parser.add_argument('-n', '--sizes', metavar='N', type=int, nargs='+',
+                        default=DEFAULT_SIZES,
+                        help='Numbers of annotations to benchmark')
+    parser.add_argument('-d', '--discontinuous', metavar='P', type=float,
+                        default=0.05,
+                        help='Fraction of annotations with two spans')
+    parser.add_argument('-s', '--slot-density', metavar='P', type=float,
+                        default=0.1,
+                        help='Fraction of mentions with an extra complex slot')
+    parser.add_argument('-m', '--ontologies', metavar='NAME', nargs='+',
+                        default=sorted(ontologies.keys()),
+                        choices=sorted(ontologies.keys()),
+                        help='Ontologies to draw annotations from')
+    parser.add_argument('-r', '--repeat', metavar='N', type=int, default=3,
+                        help='Time each phase N times, report the fastest')
+    parser.add_argument('-o', '--output', metavar='FILE', default=None,
+                        help='Save results as JSON to FILE')
+    parser.add_argument('--seed', metavar='N', type=int, default=0,
+                        help='Random seed for the generator')
+    parser.add_argument('--keep', metavar='DIR', default=None,
+                        help='Write generated corpus to DIR and keep it')
+    parser.add_argument('--convert-args', metavar='ARGS', default='',
+                        help='Options for knowtator2oa.py, e.g. "-c -e"')
+    parser.add_argument('--startup', metavar='FILE', default=None,
+                        help='Instead, time knowtator2oa.py runs on FILE '
+                        'from process start to first output byte')
+
+    return parser
+
+def generate_text(rand, num_words):
+    words = [u'protein', u'gene', u'cell', u'mouse', u'expression', u'DNA',
+             u'binding', u'receptor', u'mutant', u'tissue', u'PPAR\u03b4',
+             u'of', u'the', u'in', u'and']
+    return u' '.join(rand.choice(words) for _ in range(num_words)) + u'\n'
+
+def word_spans(text):
+    spans, start = [], 0
+    for word in text.split(u' '):
+        spans.append((start, start + len(word.rstrip(u'\n'))))
+        start += len(word) + 1
+    return spans
+
+def generate_document(rand, num_annotations, options, doc_source):
+    """Return Knowtator XML tree and text for a synthetic document."""
+    text = generate_text(rand, max(2 * num_annotations, 10))
+    words = word_spans(text)
+    generators = [ontologies[o] for o in options.ontologies]
+
+    root = ET.Element('annotations', {k2oa.a_source: doc_source})
+    mentions = []
+    slot_count = 0
+    for i in range(num_annotations):
+        mention_id = 'synthetic_Instance_%d' % i
+        first = rand.randrange(len(words) - 1)
+        spans = [words[first]]
+        if rand.random() < options.discontinuous:
+            second = rand.randrange(first + 1, len(words))
+            spans.append(words[second])
+        annotation = ET.SubElement(root, k2oa.t_annotation)
+        ET.SubElement(annotation, k2oa.t_mention, {k2oa.a_id: mention_id})
+        annotator = ET.SubElement(annotation, k2oa.t_annotator,
+                                  {k2oa.a_id: 'synthetic_Instance_0'})
+        annotator.text = 'CCP Colorado Computational Pharmacology'
+        for start, end in spans:
+            ET.SubElement(annotation, k2oa.t_span, {k2oa.a_start: str(start),
+                                                    k2oa.a_end: str(end)})
+        spanned = ET.SubElement(annotation, k2oa.t_text)
+        spanned.text = u' ... '.join(text[s:e] for s, e in spans)
+
+        class_id, slots = rand.choice(generators)(rand)
+        if rand.random() < options.slot_density:
+            slots = slots + [EXTRA_SLOT]
+        mentions.append((mention_id, class_id, slots))
+
+    for mention_id, class_id, slots in mentions:
+        mention = ET.SubElement(root, k2oa.t_classm, {k2oa.a_id: mention_id})
+        mclass = ET.SubElement(mention, k2oa.t_mclass, {k2oa.a_id: class_id})
+        mclass.text = class_id
+        slot_ids = []
+        for slot in slots:
+            slot_count += 1
+            slot_ids.append('synthetic_Instance_slot_%d' % slot_count)
+            ET.SubElement(mention, k2oa.t_hasslot, {k2oa.a_id: slot_ids[-1]})
+        for slot_id, (tag, name, value) in zip(slot_ids, slots):
+            element = ET.SubElement(root, tag, {k2oa.a_id: slot_id})
+            ET.SubElement(element, k2oa.t_mslot, {k2oa.a_id: name})
+            ET.SubElement(element, tag + 'Value', {k2oa.a_value: value})
+
+    return ET.ElementTree(root), text
+
+def write_document(directory, rand, num_annotations, options):
+    """Write synthetic Knowtator XML and text, return the XML path."""
+    doc_source = 'synthetic-%d.txt' % num_annotations
+    tree, text = generate_document(rand, num_annotations, options, doc_source)
+    with codecs.open(os.path.join(directory, doc_source), 'w',
+                     encoding=k2oa.TEXT_ENCODING) as f:
+        f.write(text)
+    xml_fn = os.path.join(directory, doc_source + '.knowtator.xml')
+    tree.write(xml_fn, encoding='UTF-8')
+    return xml_fn
+
+def best_time(func, repeat):
+    """Return (fastest time, last result) of repeat calls to func."""
+    best, result = None, None
+    for _ in range(repeat):
+        start = time.time()
+        result = func()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+def benchmark_file(job):
+    """Time conversion phases for XML file fn (run in a fresh process)."""
+    fn, convert_args, repeat = job
+    options = k2oa.argparser().parse_args(convert_args + [fn])
+    times = {}
+
+    times['parse'], parsed = best_time(lambda: k2oa.parse_tree(fn), repeat)
+    annotations, mentions, slots, doc_id, doc_source = parsed
+
+    def read_text():
+        k2oa.text_cache = k2oa.TextCache(k2oa.TEXT_CACHE_SIZE)
+        return k2oa.get_document_text(fn, doc_source, options)
+    times['text'], text = best_time(read_text, repeat)
+
+    times['validate'], _ = best_time(
+        lambda: k2oa.validate_all(annotations, text), repeat)
+
+    # convert() includes create_id(), which is also timed separately below
+    times['convert'], converted = best_time(
+        lambda: k2oa.convert(annotations, mentions, slots, doc_id, options),
+        repeat)
+
+    unidentified = [dict((k, v) for k, v in c.items() if k != k2oa.oa_id)
+                    for c in converted]
+    times['create_id'], _ = best_time(
+        lambda: [k2oa.create_id(c, options) for c in unidentified], repeat)
+
+    times['serialize'], _ = best_time(
+        lambda: [k2oa.serialize(c, options) for c in converted], repeat)
+
+    return {
+        'annotations': len(annotations),
+        'mentions': len(mentions),
+        'slots': len(slots),
+        'phases': dict((p, {
+            'seconds': times[p],
+            'annotations_per_second': (len(annotations) / times[p]
+                                       if times[p] > 0 else None),
+        }) for p in PHASES),
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+def run_benchmark(fn, convert_args, repeat):
+    # Use a fresh process for each file so that peak memory is per size.
+    pool = multiprocessing.Pool(1)
+    try:
+        return pool.apply(benchmark_file, [(fn, convert_args, repeat)])
+    finally:
+        pool.terminate()
+        pool.join()
+
+def time_to_first_byte(fn, convert_args):
+    """Return (seconds to first output byte, total seconds) for one run."""
+    start = time.time()
+    process = subprocess.Popen([sys.executable, K2OA_SCRIPT] + convert_args +
+                               [fn], stdout=subprocess.PIPE)
+    process.stdout.read(1)
+    first = time.time() - start
+    process.stdout.read()
+    if process.wait() != 0:
+        raise RuntimeError('knowtator2oa.py failed on %s' % fn)
+    return first, time.time() - start
+
+def run_startup_benchmark(fn, convert_args, repeat):
+    runs = sorted(time_to_first_byte(fn, convert_args) for _ in range(repeat))
+    return {
+        'file': fn,
+        'runs': repeat,
+        'first_byte_seconds': {
+            'min': runs[0][0],
+            'median': runs[len(runs) // 2][0],
+        },
+        'total_seconds_min': min(r[1] for r in runs),
+    }
+
+def print_startup_result(result, out=sys.stdout):
+    first = result['first_byte_seconds']
+    print >> out, ('%s: first output byte %.1f ms (median %.1f ms), '
+                   'total %.1f ms, %d runs' % (
+                       result['file'], 1000 * first['min'],
+                       1000 * first['median'],
+                       1000 * result['total_seconds_min'], result['runs']))
+
+def print_result(size, result, out=sys.stdout):
+    print >> out, 'annotations: %d (mentions %d, slots %d), peak RSS %d KB' % (
+        size, result['mentions'], result['slots'], result['peak_rss_kb'])
+    for p in PHASES:
+        phase = result['phases'][p]
+        rate = phase['annotations_per_second']
+        print >> out, '  %-10s %9.4f s %12s ann/s' % (
+            p, phase['seconds'], '%.0f' % rate if rate is not None else '-')
+
+def main(argv):
+    args = argparser().parse_args(argv[1:])
+    rand = random.Random(args.seed)
+
+    if args.startup is not None:
+        result = run_startup_benchmark(args.startup, args.convert_args.split(),
+                                       args.repeat)
+        print_startup_result(result)
+        if args.output is not None:
+            with open(args.output, 'w') as f:
+                json.dump(result, f, sort_keys=True, indent=2,
+                          separators=(',', ': '))
+        return 0
+
+    if args.keep is not None:
+        directory = args.keep
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+    else:
+        directory = tempfile.mkdtemp(prefix='knowtator2oa-bench-')
+
+    results = []
+    try:
+        for size in args.sizes:
+            fn = write_document(directory, rand, size, args)
+            result = run_benchmark(fn, args.convert_args.split(), args.repeat)
+            result['size'] = size
+            results.append(result)
+            print_result(size, result)
+    finally:
+        if args.keep is None:
+            shutil.rmtree(directory)
+
+    if args.output is not None:
+        config = dict((k, v) for k, v in vars(args).items()
+                      if k not in ('output', 'keep'))
+        with open(args.output, 'w') as f:
+            json.dump({'config': config, 'results': results}, f,
+                      sort_keys=True, indent=2, separators=(',', ': '))
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -31,11 +31,4 @@ if [ -e "$outdir" ]; then
     exit 1
 fi
 
-mkdir "$outdir"
-
-for f in $(ls "$indir"/{chebi,cl,entrezgene,go_bpmf,go_cc,ncbitaxon,pr,so,sections-and-typography} | \
-    egrep '\.xml$' | sort | uniq); do
-    o="$outdir"/$(basename "$f" .txt.knowtator.xml).jsonld
-    echo "Converting $f to $o ... " >&2
-    ./knowtator2oa.py -d "$textdir" "$indir"/{chebi,cl,entrezgene,go_bpmf,go_cc,ncbitaxon,pr,so,sections-and-typography}/$f > "$o"
-done
+./knowtator2oa.py --corpus "$1" --out "$outdir" --combined
@@ -30,13 +30,4 @@ if [ -e "$outdir" ]; then
     exit 1
 fi
 
-for d in "$indir"/*; do
-    n=$(basename "$d")
-    od="$outdir/$n"
-    mkdir -p "$od"
-    for f in "$d"/*; do
-	o="$od"/$(basename "$f" .txt.knowtator.xml).jsonld
-	echo "Converting $f into $o ..." >&2
-	./knowtator2oa.py -e -d "$textdir" "$f" > "$o"
-    done
-done
\ No newline at end of file
+./knowtator2oa.py -e --corpus "$1" --out "$outdir"
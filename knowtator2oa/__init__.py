@@ -0,0 +1,2866 @@
+"""Convert Knowtator XML into Open Annotation format.
+
+The knowtator2oa.py script runs main().
+"""
+
+import os
+import sys
+import six
+import json
+import json.encoder
+import itertools
+import array
+import collections
+import codecs
+import hashlib
+import re
+import heapq
+import time
+
+# Modules needed only by some options (uuid for -r, urlparse for -e,
+# zlib and marshal for --parse-cache, struct for --span-index, etc.)
+# are imported where used to keep startup fast.
+import xml.etree.ElementTree as ET
+
+usage = 'knowtator2oa.py FILE [FILE [...]]'
+
+# Context description that is recommended for use in systems that
+# implement the Open Annotation data model, copied Jan 2015 from
+# http://www.openannotation.org/spec/core/publishing.html
+oa_recommended_context = """\"oa": "http://www.w3.org/ns/oa#",
+    "cnt": "http://www.w3.org/2011/content#",
+    "dc": "http://purl.org/dc/elements/1.1/",
+    "dcterms": "http://purl.org/dc/terms/",
+    "dctypes": "http://purl.org/dc/dcmitype/",
+    "foaf": "http://xmlns.com/foaf/0.1/",
+    "rdf": "http://www.w3.org/1999/02/22-rdf-syntax-ns#",
+    "rdfs": "http://www.w3.org/2000/01/rdf-schema#",
+    "skos": "http://www.w3.org/2004/02/skos/core#",
+    "owl": "http://www.w3.org/2002/07/owl#",
+    "prov": "http://www.w3.org/ns/prov#",
+    "trig": "http://www.w3.org/2004/03/trix/rdfg-1/",
+    "xsd": "http://www.w3.org/2001/XMLSchema#",
+
+    "hasBody" :         {"@type":"@id", "@id" : "oa:hasBody"},
+    "hasTarget" :       {"@type":"@id", "@id" : "oa:hasTarget"},
+    "hasSource" :       {"@type":"@id", "@id" : "oa:hasSource"},
+    "hasSelector" :     {"@type":"@id", "@id" : "oa:hasSelector"},
+    "hasState" :        {"@type":"@id", "@id" : "oa:hasState"},
+    "hasScope" :        {"@type":"@id", "@id" : "oa:hasScope"},
+    "annotatedBy" :  {"@type":"@id", "@id" : "oa:annotatedBy"},
+    "serializedBy" : {"@type":"@id", "@id" : "oa:serializedBy"},
+    "motivatedBy" :  {"@type":"@id", "@id" : "oa:motivatedBy"},
+    "equivalentTo" : {"@type":"@id", "@id" : "oa:equivalentTo"},
+    "styledBy" :     {"@type":"@id", "@id" : "oa:styledBy"},
+    "cachedSource" : {"@type":"@id", "@id" : "oa:cachedSource"},
+    "conformsTo" :   {"@type":"@id", "@id" : "dcterms:conformsTo"},
+    "default" :      {"@type":"@id", "@id" : "oa:default"},
+    "item" :         {"@type":"@id", "@id" : "oa:item"},
+    "first":         {"@type":"@id", "@id" : "rdf:first"},
+    "rest":          {"@type":"@id", "@id" : "rdf:rest", "@container" : "@list"},
+
+    "annotatedAt" :  { "@type": "xsd:dateTimeStamp", "@id": "oa:annotatedAt" },
+    "end" :          { "@type": "xsd:nonNegativeInteger", "@id": "oa:end" },
+    "exact" :        "oa:exact",
+    "prefix" :       "oa:prefix",
+    "serializedAt" : { "@type": "xsd:dateTimeStamp", "@id": "oa:serializedAt" },
+    "start" :        { "@type": "xsd:nonNegativeInteger", "@id": "oa:start" },
+    "styleClass" :   "oa:styleClass",
+    "suffix" :       "oa:suffix",
+    "when" :         { "@type": "xsd:dateTimeStamp", "@id": "oa:when" },
+
+    "chars" :        "cnt:chars",
+    "bytes" :        "cnt:bytes",
+    "format" :       "dc:format",
+    "language" :     "dc:language",
+    "value" :        "rdf:value",
+    "label" :        "rdfs:label",
+    "name" :         "foaf:name",
+    "mbox" :         "foaf:mbox\""""
+
+# Compact OA context: minimal subset of the above (+oaAnn)
+compact_oa_context = """\"oa": "http://www.w3.org/ns/oa#",
+    "oaAnn": "http://www.w3.org/ns/oa#Annotation",
+    "hasBody" :      { "@type": "@id", "@id": "oa:hasBody" },
+    "hasTarget" :    { "@type": "@id", "@id": "oa:hasTarget" },
+    "hasSource" :    { "@type": "@id", "@id": "oa:hasSource" },
+    "hasSelector" :  { "@type": "@id", "@id": "oa:hasSelector" },
+    "annotatedBy" :  { "@type": "@id", "@id": "oa:annotatedBy" },
+    "serializedBy" : { "@type": "@id", "@id": "oa:serializedBy" },
+    "annotatedAt" :  { "@type": "xsd:dateTimeStamp", "@id": "oa:annotatedAt" },
+    "serializedAt" : { "@type": "xsd:dateTimeStamp", "@id": "oa:serializedAt" },
+    "start" :        { "@type": "xsd:nonNegativeInteger", "@id": "oa:start" },
+    "end" :          { "@type": "xsd:nonNegativeInteger", "@id": "oa:end" }"""
+
+# Local prefixes for compact output
+compact_prefix_map = {
+    'http://craft.ucdenver.edu/annotation/': 'ann',
+    'http://purl.obolibrary.org/obo/CHEBI_': 'CHEBI',
+    'http://purl.obolibrary.org/obo/CL_': 'CL',
+    'http://purl.obolibrary.org/obo/GO_': 'GO',
+    'http://purl.obolibrary.org/obo/PR_': 'PR',
+    'http://purl.obolibrary.org/obo/SO_': 'SO',
+    'http://purl.obolibrary.org/obo/NCBITaxon_': 'NCBITaxon',
+    'http://purl.obolibrary.org/obo/BFO_': 'BFO',
+    'http://purl.obolibrary.org/obo/IAO_': 'IAO',
+    'http://www.ncbi.nlm.nih.gov/gene/': 'NCBIGene',
+    'http://compbio.ucdenver.edu/': 'ucdenver',
+    'http://bionlp-corpora.sourceforge.net/CRAFT/1.0/': 'craft',
+}
+
+# Built on first use by get_compact_context()
+compact_context = None
+
+def get_compact_context():
+    """Return compact context: compact OA context and local prefixes."""
+    global compact_context
+    if compact_context is None:
+        compact_context = ',\n'.join(
+            [compact_oa_context] +
+            ['    "%s": "%s"' % (p, f) for f, p in compact_prefix_map.items()]
+            )
+    return compact_context
+
+# Span validation modes; sample checks every VALIDATE_SAMPLE_STRIDEth
+VALIDATE_MODES = ('full', 'sample', 'off')
+VALIDATE_SAMPLE_STRIDE = 10
+
+# Minimum number of annotations to validate using NumPy, if available
+NUMPY_MIN_ANNOTATIONS = 100
+
+# Default shard size (annotations) and index file name for --shards
+SHARD_ANNOTATIONS = 100000
+SHARD_INDEX_FILE = 'index.json'
+
+# File type marker for --span-index files
+SPAN_INDEX_MAGIC = 'K2OASPN2'
+
+# Parse cache format version, default size limit (MB) and file suffix
+PARSE_CACHE_VERSION = '2'
+PARSE_CACHE_SIZE = 1024
+PARSE_CACHE_SUFFIX = '.parsed'
+
+# Eviction frees the parse cache down to this fraction of its size
+# limit, so that a full cache is not scanned again on every store
+PARSE_CACHE_EVICT_TO = 0.9
+
+# Annotation ID generation schemes
+ID_SCHEMES = ('legacy', 'fast', 'uuid')
+
+# Output formats
+OUTPUT_FORMATS = ('pretty', 'minified', 'jsonl', 'nt', 'nq')
+
+# Output formats writing RDF statements instead of JSON-LD
+RDF_FORMATS = ('nt', 'nq')
+
+# Number of characters to collect before writing to output
+OUTPUT_BUFFER_SIZE = 1024 * 1024
+
+# Maximum number of entries in ID mapping memos
+MEMO_SIZE = 100000
+
+# Encoding to read text files in
+TEXT_ENCODING='utf-8'
+
+# Maximum number of characters of document text to keep in memory
+TEXT_CACHE_SIZE = 64 * 1024 * 1024
+
+# CRAFT corpus layout (relative to corpus root)
+CRAFT_XML_DIR = 'knowtator-xml'
+CRAFT_TEXT_DIR = os.path.join('articles', 'txt')
+
+# CRAFT annotation directories combined into one file per article
+craft_combined_layers = [
+    'chebi',
+    'cl',
+    'entrezgene',
+    'go_bpmf',
+    'go_cc',
+    'ncbitaxon',
+    'pr',
+    'so',
+    'sections-and-typography',
+]
+
+# Manifest of inputs to outputs in --corpus output directory
+MANIFEST_FILE = '.knowtator2oa-manifest.json'
+
+# Options affecting output, recorded in the manifest
+manifest_options = [
+    'compact',
+    'expand_frag',
+    'limit_id',
+    'random_ids',
+    'id_scheme',
+    'stream',
+    'format',
+    'combined',
+    'merge',
+]
+
+# Options applying to a whole run that --serve jobs cannot set
+serve_run_options = [
+    'corpus',
+    'out',
+    'combined',
+    'force',
+    'shards',
+    'shard_annotations',
+    'shard_bytes',
+    'span_index',
+    'stats',
+    'profile',
+    'profile_out',
+    'text_cache_size',
+    'parse_cache_size',
+    'serve',
+    'serve_socket',
+]
+
+# Options a --serve or --serve-socket process itself uses; others are
+# given per job and are errors on its command line
+serve_process_options = [
+    'text_cache_size',
+    'serve',
+    'serve_socket',
+]
+
+DOCUMENT_ID_ROOT = 'http://bionlp-corpora.sourceforge.net/CRAFT/1.0/'
+ANNOTATION_ID_ROOT = 'http://craft.ucdenver.edu/annotation/'
+ANNOTATOR_ID_ROOT = 'http://kabob.ucdenver.edu/annotator/'
+
+# Mapping to resolvable annotator URIs
+annotator_mapping = {
+    'http://kabob.ucdenver.edu/annotator/CCPColoradoComputationalPharmacology':  'http://compbio.ucdenver.edu/Hunter_lab',
+    'http://kabob.ucdenver.edu/annotator/CCPColoradoComputationalPharmacology,UCDenver':  'http://compbio.ucdenver.edu/Hunter_lab',
+}
+
+# Attribute name constants
+a_id = 'id'
+a_source = 'textSource'
+a_start = 'start'
+a_end = 'end'
+a_value = 'value'
+
+# Tag name constants
+t_annotation = 'annotation'
+t_span = 'span'
+t_text = 'spannedText'
+t_annotator = 'annotator'
+t_mention = 'mention'
+t_classm = 'classMention'
+t_mclass = 'mentionClass'
+t_hasslot = 'hasSlotMention'
+t_boolslot = 'booleanSlotMention'
+t_intslot = 'integerSlotMention'
+t_strslot = 'stringSlotMention'
+t_cmpxslot = 'complexSlotMention'
+t_mslot = 'mentionSlot'
+t_boolval = 'booleanSlotMentionValue'
+t_intval = 'integerSlotMentionValue'
+t_strval = 'stringSlotMentionValue'
+t_cmpxval = 'complexSlotMentionValue'
+
+# OA constats
+oa_id = '@id'
+oa_type = '@type'
+oa_context = '@context'
+oa_default_type = 'oa:Annotation'
+oa_compact_type = 'oaAnn'
+oa_hasTarget = 'hasTarget'
+oa_hasBody = 'hasBody'
+oa_annotatedAt = 'annotatedAt'
+oa_annotatedBy = 'annotatedBy'
+oa_hasSource = 'hasSource'
+oa_hasSelector = 'hasSelector'
+oa_start = 'start'
+oa_end = 'end'
+
+# IDs of slots to discard as irrelevant (CRAFT-specific)
+irrelevant_slot = set([
+        'taxon ambiguity',  # boolean, false in 7434/7437 cases
+        'common name',      # taxon common name
+        'macromolecular complex or protein ambiguity', # boolean
+        'is_substituent_group_from', # single instance in whole corpus
+        'section name',
+])
+
+def argparser():
+    import argparse
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('-c', '--compact', action='store_true', default=False,
+                        help='Compact output')
+    parser.add_argument('-d', '--textdir', metavar='DIR', default=None,
+                        help='Directory with text files')
+    parser.add_argument('--validate', choices=VALIDATE_MODES, default='full',
+                        help='Check annotation texts against all spans, '
+                        'a sample of every %dth annotation, or not at all' %
+                        VALIDATE_SAMPLE_STRIDE)
+    parser.add_argument('-e', '--expand-frag', action='store_true',
+                        default=False, help='Expand fragment selectors')
+    parser.add_argument('--text-cache-size', metavar='N', type=int,
+                        default=TEXT_CACHE_SIZE,
+                        help='Cache up to N characters of document text')
+    parser.add_argument('-l', '--limit-id', metavar='N', type=int, default=10,
+                        help='Limit annotation IDs to N characters')
+    parser.add_argument('-r', '--random-ids', action='store_true',
+                        default=False, help='Random UUIDs')
+    parser.add_argument('--id-scheme', choices=ID_SCHEMES, default='fast',
+                        help='Annotation ID generation (legacy and fast give '
+                        'identical content hashes, uuid is random)')
+    parser.add_argument('-f', '--format', choices=OUTPUT_FORMATS,
+                        default='pretty', help='Output format (jsonl: one '
+                        'annotation per line after a context line; nt, nq: '
+                        'N-Triples, N-Quads)')
+    parser.add_argument('-j', '--jobs', metavar='N', type=int, default=1,
+                        help='Convert using N processes (0: one per CPU)')
+    parser.add_argument('--prefetch', metavar='N', type=int, default=0,
+                        help='Read up to N files ahead in threads and write '
+                        'output in a writer thread (without --jobs)')
+    parser.add_argument('-s', '--stream', action='store_true', default=False,
+                        help='Parse incrementally with bounded memory')
+    parser.add_argument('--merge', action='store_true', default=False,
+                        help='Merge FILEs as layers of one document in span '
+                        'order, dropping duplicate annotations (layers are '
+                        'spilled to temporary files)')
+    parser.add_argument('--corpus', metavar='ROOT', default=None,
+                        help='Convert CRAFT corpus in directory ROOT')
+    parser.add_argument('--out', metavar='DIR', default=None,
+                        help='Output directory for --corpus')
+    parser.add_argument('--combined', action='store_true', default=False,
+                        help='Combine ontologies for --corpus, one file '
+                        'per article')
+    parser.add_argument('--parse-cache', metavar='DIR', default=None,
+                        help='Cache parsed and validated input in DIR')
+    parser.add_argument('--parse-cache-size', metavar='MB', type=int,
+                        default=PARSE_CACHE_SIZE,
+                        help='Limit --parse-cache to MB megabytes')
+    parser.add_argument('--span-index', metavar='FILE', default=None,
+                        help='Write index of annotations by span to FILE')
+    parser.add_argument('--stats', metavar='FILE', default=None,
+                        help='Write per-file phase times and counts, '
+                        'including bytes written, to FILE')
+    parser.add_argument('--profile', metavar='FILE', default=None,
+                        help='Profile conversion of input FILE with cProfile')
+    parser.add_argument('--profile-out', metavar='FILE',
+                        default='knowtator2oa.prof',
+                        help='Write --profile data to FILE')
+    parser.add_argument('--shards', metavar='DIR', default=None,
+                        help='Write gzip-compressed shards and index to DIR')
+    parser.add_argument('--shard-annotations', metavar='N', type=int,
+                        default=SHARD_ANNOTATIONS,
+                        help='Start a new shard after N annotations')
+    parser.add_argument('--shard-bytes', metavar='N', type=int, default=None,
+                        help='Start a new shard after N compressed bytes')
+    parser.add_argument('--serve', action='store_true', default=False,
+                        help='Convert JSON job requests read from stdin')
+    parser.add_argument('--serve-socket', metavar='PATH', default=None,
+                        help='Convert JSON job requests from Unix socket PATH')
+    parser.add_argument('--force', action='store_true', default=False,
+                        help='Convert all of --corpus even if up to date')
+    parser.add_argument('file', metavar='FILE', nargs='*',
+                        help='Knowtator XML file to convert')
+
+    return parser
+
+def find_only(element, tag):
+    """Return the only subelement with tag(s)."""
+    if isinstance(tag, six.string_types):
+        tag = [tag]
+    found = []
+    for t in tag:
+        found.extend(element.findall(t))
+    assert len(found) == 1, 'expected one <%s>, got %d' % (tag, len(found))
+    return found[0]
+
+def find_one_or_more(element, tag):
+    """Return subelements with tag, checking that there is at least one."""
+    s = element.findall(tag)
+    assert len(s) >= 1, 'expected at least one <%s>, got %d' % (tag, len(s))
+    return s
+
+def get_document_id(root):
+    return source_document_id(root.attrib[a_source])
+
+def source_document_id(source):
+    # if source.endswith('.txt'):
+    #     source = source[:-4]
+    return DOCUMENT_ID_ROOT + source
+
+def get_document_source(root):
+    return root.attrib[a_source]
+
+def get_mention_id(annotation):
+    mention = find_only(annotation, t_mention)
+    return mention.attrib[a_id]
+
+def get_spans(annotation):
+    spans = []
+    for span in find_one_or_more(annotation, t_span):
+        spans.append((int(span.attrib[a_start]), int(span.attrib[a_end])))
+    return spans
+
+def get_text(annotation):
+    text = find_only(annotation, t_text)
+    return text.text
+
+def get_annotator(annotation):
+    annotator = find_only(annotation, t_annotator)
+    return annotator.text # ignore id
+
+class Memo(dict):
+    """Dictionary that is emptied when it reaches max_size entries."""
+    def __init__(self, max_size=MEMO_SIZE):
+        super(Memo, self).__init__()
+        self.max_size = max_size
+
+    def __setitem__(self, key, value):
+        if len(self) >= self.max_size:
+            self.clear()
+        super(Memo, self).__setitem__(key, value)
+
+strings = Memo()
+
+def intern_string(s):
+    """Return a shared instance of string s."""
+    try:
+        return strings[s]
+    except KeyError:
+        strings[s] = s
+        return s
+
+annotator_uris = Memo()
+
+def annotator_uri(annotator):
+    try:
+        return annotator_uris[annotator]
+    except KeyError:
+        uri = intern_string(ANNOTATOR_ID_ROOT + annotator.replace(' ', ''))
+        annotator_uris[annotator] = uri
+        return uri
+
+class Annotation(object):
+    __slots__ = ('mention_id', 'mention_index', 'offsets', 'text', 'annotator')
+
+    def __init__(self, mention_id, spans, text, annotator):
+        self.mention_id = mention_id
+        self.mention_index = None    # set by resolve_references()
+        # Span start and end offsets, flattened
+        self.offsets = array.array('l', [o for span in spans for o in span])
+        self.text = text
+        self.annotator = annotator_uri(annotator)
+
+    @property
+    def spans(self):
+        o = self.offsets
+        return [(o[i], o[i+1]) for i in range(0, len(o), 2)]
+
+    def targets(self, doc_id):
+        targets = ['%s#char=%d,%d' % (doc_id, s[0], s[1]) for s in self.spans]
+        if len(targets) == 1:
+            return targets[0]
+        else:
+            return targets
+
+    def __str__(self):
+        return str((self.mention_id, self.spans, self.text, self.annotator))
+
+    @classmethod
+    def from_element(cls, element):
+        expected = (t_mention, t_annotator, t_span, t_text)
+        assert not any(True for e in element if e.tag not in expected)
+        return cls(get_mention_id(element),
+                   get_spans(element),
+                   get_text(element),
+                   get_annotator(element))
+
+class Mention(object):
+    __slots__ = ('id', 'class_id', 'class_text', 'slot_ids', 'slot_indices')
+
+    def __init__(self, id_, class_id, class_text, slot_ids):
+        self.id = id_
+        self.class_id = intern_string(class_id)
+        self.class_text = intern_string(class_text)
+        self.slot_ids = slot_ids
+        self.slot_indices = None    # set by resolve_references()
+
+    def values(self, slots):
+        # slots are the Slot objects referenced by slot_ids, in order.
+
+        # First, discard values that are known to be irrelevant to the
+        # core information content (e.g. redundant common names)
+        relevant = [s for s in slots if s.slot_id not in irrelevant_slot]
+        count('dropped_slots', len(slots) - len(relevant))
+
+        # If there are no slots (indirect values), assume that the
+        # value is the class ID (this holds e.g. for most OBOs in
+        # CRAFT). Otherwise, draw values from the slots, affixing the
+        # slot ID to differentiate between values types.
+        if len(relevant) == 0:
+            values = [self.class_id]
+        else:
+            values = [s.slot_id + ':' + s.value for s in relevant]
+
+        if len(values) == 1:
+            return values[0]
+        else:
+            return values
+
+    def __str__(self):
+        return str((self.id, self.class_id, self.class_text, self.slot_ids))
+
+    @classmethod
+    def from_element(cls, element):
+        expected = (t_mclass, t_hasslot)
+        assert not any(True for e in element if e.tag not in expected),\
+            'unexpected child: ' + ' '.join(['<%s>' % e.tag for e in element])
+        mclass = find_only(element, t_mclass)
+        slot_ids = [s.attrib[a_id] for s in element.findall(t_hasslot)]
+        return cls(element.attrib[a_id],
+                   mclass.attrib[a_id],
+                   mclass.text,
+                   slot_ids)
+
+class Slot(object):
+    __slots__ = ('id', 'slot_id', 'value_type', 'value')
+
+    def __init__(self, id_, slot_id, value_type, value):
+        self.id = id_
+        self.slot_id = intern_string(slot_id)
+        self.value_type = intern_string(value_type)
+        self.value = intern_string(value)
+
+    def __str__(self):
+        return str((self.id, self.slot_id, self.value_type, self.value))
+
+    @classmethod
+    def from_element(cls, element):
+        expected = (t_mslot, t_boolval, t_intval, t_strval, t_cmpxval)
+        assert not any(True for e in element if e.tag not in expected)
+        mslot = find_only(element, t_mslot)
+        value = find_only(element, (t_boolval, t_intval, t_strval, t_cmpxval))
+        value_type = value.tag.replace('SlotMention', '')
+        return cls(element.attrib[a_id],
+                   mslot.attrib[a_id],
+                   value_type,
+                   value.attrib[a_value])
+
+prefix_uri_map = {
+    'CHEBI:': 'http://purl.obolibrary.org/obo/CHEBI_%s',
+    'CL:':    'http://purl.obolibrary.org/obo/CL_%s',
+    'GO:':    'http://purl.obolibrary.org/obo/GO_%s',
+    'PR:':    'http://purl.obolibrary.org/obo/PR_%s',
+    'SO:':    'http://purl.obolibrary.org/obo/SO_%s',
+    'taxonomy ID:': 'http://purl.obolibrary.org/obo/NCBITaxon_%s',
+    'has Entrez Gene ID:': 'http://www.ncbi.nlm.nih.gov/gene/%s',
+}
+
+id_uri_map = {
+    'independent_continuant': 'http://purl.obolibrary.org/obo/BFO_0000004',
+    # NCBI taxonomy non-specific
+    'taxonomic_rank': 'http://purl.obolibrary.org/obo/NCBITaxon_taxonomic_rank',
+    'species': 'http://purl.obolibrary.org/obo/NCBITaxon_species',
+    'subspecies': 'http://purl.obolibrary.org/obo/NCBITaxon_subspecies',
+    'phylum': 'http://purl.obolibrary.org/obo/NCBITaxon_phylum',
+    'kingdom': 'http://purl.obolibrary.org/obo/NCBITaxon_kingdom',
+    # Typography
+    'bold': 'http://www.w3.org/TR/html/#b',
+    'italic': 'http://www.w3.org/TR/html/#i',
+    'underline': 'http://www.w3.org/TR/html/#u',
+    'sub': 'http://www.w3.org/TR/html/#sup',
+    'sup': 'http://www.w3.org/TR/html/#sub',
+    'section': 'http://purl.obolibrary.org/obo/IAO_0000314',
+}
+
+class Stats(object):
+    """Per-file phase times and counts for --stats.
+
+    Phase times are in seconds; the convert phase includes create_id.
+    The bytes count of a file is the UTF-8 length of its documents and
+    the separators before them. The total counts all bytes written to
+    output, headers and footers included (compressed with --shards).
+    """
+    def __init__(self):
+        self.files = collections.OrderedDict()
+        self.current = None
+        self.output_bytes = 0
+
+    def start_file(self, fn):
+        self.current = self.files.setdefault(fn, {
+            'time': collections.Counter(),
+            'count': collections.Counter(),
+        })
+
+    def add_time(self, phase, seconds):
+        self.current['time'][phase] += seconds
+
+    def count(self, name, n=1):
+        self.current['count'][name] += n
+
+    def take(self):
+        """Return and reset collected statistics."""
+        taken = self.files, self.output_bytes
+        self.files, self.current = collections.OrderedDict(), None
+        self.output_bytes = 0
+        return taken
+
+    def merge(self, taken):
+        files, output_bytes = taken
+        for fn, record in files.items():
+            self.start_file(fn)
+            self.current['time'].update(record['time'])
+            self.current['count'].update(record['count'])
+        self.current = None
+        self.output_bytes += output_bytes
+
+    def report(self):
+        total = {'time': collections.Counter(), 'count': collections.Counter()}
+        for record in self.files.values():
+            total['time'].update(record['time'])
+            total['count'].update(record['count'])
+        total['count']['bytes'] = self.output_bytes
+        return {'files': self.files, 'total': total}
+
+    def write(self, fn):
+        with open(fn, 'w') as out:
+            json.dump(self.report(), out, sort_keys=True, indent=2,
+                      separators=(',', ': '))
+
+# Statistics collected for --stats, None if disabled
+stats = None
+
+# Spans collected for --span-index, None if disabled
+span_index = None
+
+def timed(phase, func, *args, **kwargs):
+    """Call func, adding its wall time to phase if stats are enabled."""
+    if stats is None:
+        return func(*args, **kwargs)
+    start = time.time()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        stats.add_time(phase, time.time() - start)
+
+def count(name, n=1):
+    if stats is not None:
+        stats.count(name, n)
+
+def encoded_length(data):
+    """Return length in bytes of data (str or unicode, as UTF-8)."""
+    if isinstance(data, six.text_type):
+        return len(data.encode('utf-8'))
+    else:
+        return len(data)
+
+def count_output(data):
+    """Count bytes of data written to output in total."""
+    if stats is not None:
+        stats.output_bytes += encoded_length(data)
+
+def count_file_output(data):
+    """Count bytes of data written to output for the current file."""
+    if stats is not None and stats.current is not None:
+        stats.count('bytes', encoded_length(data))
+
+def take_worker_state():
+    """Return and reset state that process pool workers report back."""
+    return (take_unmapped(),
+            take_mismatches(),
+            stats.take() if stats is not None else None,
+            span_index.take() if span_index is not None else None)
+
+def merge_worker_state(state):
+    unmapped, mismatches, taken, spans = state
+    unmapped_ids.update(unmapped)
+    text_mismatches.update(mismatches)
+    if taken is not None:
+        stats.merge(taken)
+    if spans is not None:
+        span_index.merge(spans)
+
+def prefix_regex(prefixes):
+    """Return regex matching the longest of prefixes at string start."""
+    prefixes = sorted(prefixes, key=len, reverse=True)
+    return re.compile('|'.join(re.escape(p) for p in prefixes))
+
+prefix_uri_re = prefix_regex(prefix_uri_map)
+id_uri_memo = Memo()
+
+# Counts of IDs that could not be mapped to URIs, reported once each
+unmapped_ids = collections.Counter()
+
+def id_to_uri(id_):
+    try:
+        return id_uri_memo[id_]
+    except KeyError:
+        pass
+    if id_ in id_uri_map:
+        uri = id_uri_map[id_]
+    else:
+        m = prefix_uri_re.match(id_)
+        if m is None:
+            unmapped_ids[id_] += 1
+            count('unmapped_ids')
+            return id_
+        p = m.group(0)
+        uri = prefix_uri_map[p] % id_[len(p):]
+    id_uri_memo[id_] = uri
+    return uri
+
+def take_unmapped():
+    """Return and reset counts of IDs that failed to map."""
+    unmapped = collections.Counter(unmapped_ids)
+    unmapped_ids.clear()
+    return unmapped
+
+def report_unmapped(out=None):
+    """Write one warning for each ID that failed to map."""
+    if out is None:
+        out = sys.stderr
+    for id_, count in sorted(take_unmapped().items()):
+        print >> out, 'Warning: failed to map %s (%d times)' % (id_, count)
+
+def ids_to_uris(ids):
+    if isinstance(ids, six.string_types):
+        return id_to_uri(ids)
+    else:
+        return [id_to_uri(i) for i in ids]
+
+def pretty_print(doc, initial_indent=0):
+    s = json.dumps(doc, sort_keys=True, indent=2, separators=(',', ': '))
+    if initial_indent == 0:
+        return s
+    else:
+        idt = ' ' * initial_indent
+        return idt + s.replace('\n', '\n'+idt)
+
+compact_prefix_re = prefix_regex(compact_prefix_map)
+compact_memo = Memo()
+
+def compact(s, prefix_map):
+    if prefix_map is compact_prefix_map:
+        try:
+            return compact_memo[s]
+        except KeyError:
+            pass
+        m = compact_prefix_re.match(s)
+        if m is None:
+            compacted = s
+        else:
+            compacted = compact_prefix(s, m.group(0), prefix_map)
+        compact_memo[s] = compacted
+        return compacted
+    for pref in prefix_map:
+        if s.startswith(pref):
+            return compact_prefix(s, pref, prefix_map)
+    return s
+
+def compact_prefix(s, pref, prefix_map):
+    short = prefix_map[pref]
+    if s == pref:
+        return short
+    else:
+        return '%s:%s' % (short, s[len(pref):])
+
+def compact_values(document, prefix_map=None):
+    if prefix_map is None:
+        prefix_map = compact_prefix_map
+    compacted = {}
+    for key, val in document.items():
+        if isinstance(val, six.string_types):
+            val = compact(val, prefix_map)
+        elif isinstance(val, list):
+            val = [compact(v, prefix_map)
+                   if isinstance(v, six.string_types) else v for v in val]
+        else:
+            pass # TODO recurse into objects
+        compacted[key] = val
+    return compacted
+
+char_fragment_re = re.compile(r'^char=(\d+),(\d+)$')
+
+def parse_frag(frag):
+    # parse rfc5147 text/plain chracter range fragment identifier
+    # (TODO others)
+    m = char_fragment_re.match(frag)
+    if not m:
+        raise ValueError('failed to parse fragment %s' % frag)
+    start, end = m.groups()
+    try:
+        return int(start), int(end)
+    except ValueError:
+        raise ValueError('failed to parse fragment %s' % frag)
+
+def expand_fragment(target):
+    import urlparse
+    url, frag = urlparse.urldefrag(target)
+    start, end = parse_frag(frag)
+    return {
+        oa_hasSource : url,
+        oa_hasSelector : {
+            oa_start: start,
+            oa_end: end
+        },
+    }
+
+def expand_fragments(document):
+    tgt = document[oa_hasTarget]
+    if isinstance(tgt, six.string_types):
+        tgt = expand_fragment(tgt)
+    else:
+        assert isinstance(tgt, list)
+        tgt = [expand_fragment(t) for t in tgt]
+    document[oa_hasTarget] = tgt
+    return document
+
+def sha1(s):
+    return hashlib.sha1(s).hexdigest()
+
+encode_json_string = json.encoder.encode_basestring_ascii
+
+def canonical_json(document):
+    """Return json.dumps(document, separators=(',',':'), sort_keys=True).
+
+    Builds the serialization directly for the flat documents created by
+    convert_annotation(), where all values are strings or lists of
+    strings, and falls back to json.dumps() otherwise.
+    """
+    parts = []
+    for key in sorted(document):
+        value = document[key]
+        if isinstance(value, six.string_types):
+            value = encode_json_string(value)
+        elif (isinstance(value, list) and
+              all(isinstance(v, six.string_types) for v in value)):
+            value = '[%s]' % ','.join(encode_json_string(v) for v in value)
+        else:
+            return json.dumps(document, separators=(',',':'), sort_keys=True)
+        parts.append('%s:%s' % (encode_json_string(key), value))
+    return '{%s}' % ','.join(parts)
+
+def create_id(document, options=None):
+    scheme = id_scheme(options)
+    if scheme == 'legacy':
+        # TODO: consider expanding JSON-LD
+        serialized = json.dumps(document, separators=(',',':'), sort_keys=True)
+        id_ = sha1(serialized)
+    elif scheme == 'fast':
+        id_ = sha1(canonical_json(document))
+    else:
+        import uuid
+        id_ = str(uuid.uuid4()) # random uuid as default
+    if options is not None and options.limit_id is not None:
+        id_ = id_[:options.limit_id]
+    return ANNOTATION_ID_ROOT + id_
+
+def id_scheme(options=None):
+    if options is None or options.random_ids:
+        return 'uuid'
+    else:
+        return options.id_scheme
+
+def convert_annotation(annotation, mention, slots, doc_id, options=None):
+    """Return OA document for annotation, its mention and their slots."""
+    if not options or not options.compact:
+        oa_type_value = oa_default_type
+    else:
+        oa_type_value = oa_compact_type
+
+    values = mention.values(slots)
+    annotator = annotation.annotator
+    annotator = annotator_mapping.get(annotator, annotator)
+    document = {
+        oa_type:        oa_type_value,
+        oa_hasTarget:   annotation.targets(doc_id),
+        oa_hasBody:     ids_to_uris(values),
+        oa_annotatedBy: annotator,
+        #oa_annotatedAt: # Knowtator XML doesn't include this
+        }
+    document[oa_id] = timed('create_id', create_id, document, options)
+    if options and options.expand_frag:
+        document = expand_fragments(document)
+    if options and options.compact and not rdf_output(options):
+        document = compact_values(document)
+    return document
+
+def resolve_references(annotations, mentions, slots):
+    """Set mention_index and slot_indices from mention and slot IDs."""
+    # There should be exactly one mention for each annotation. The two
+    # are connected by annotation.mention_id == mention.id
+    assert len(annotations) == len(mentions)
+    mention_index = dict((m.id, i) for i, m in enumerate(mentions))
+    slot_index = dict((s.id, i) for i, s in enumerate(slots))
+    for annotation in annotations:
+        annotation.mention_index = mention_index[annotation.mention_id]
+    for mention in mentions:
+        mention.slot_indices = [slot_index[i] for i in mention.slot_ids]
+
+def mention_slots(mention, slots):
+    """Return the slots of mention by indices from resolve_references()."""
+    return [slots[i] for i in mention.slot_indices]
+
+def convert(annotations, mentions, slots, doc_id, options=None):
+    """Convert annotations, mentions and slots as returned by parse().
+
+    The inputs must come from parse() or parse_tree(), which resolve
+    mention and slot references to list indices (mention_index and
+    slot_indices) with resolve_references().
+    """
+    converted = []
+    for annotation in annotations:
+        mention = mentions[annotation.mention_index]
+        converted.append(convert_annotation(annotation, mention,
+                                            mention_slots(mention, slots),
+                                            doc_id, options))
+    return converted
+
+class TextCache(object):
+    """Least recently used cache of text file contents keyed by path.
+
+    The cache is bounded by the total number of characters it holds.
+    Entries record the modification time and size of their file and
+    are only used while these are unchanged.
+    """
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.size = 0
+        self.texts = collections.OrderedDict()    # path: (stamp, text)
+
+    def peek(self, fn):
+        """Return cached text of fn or None, without marking it used."""
+        entry = self.texts.get(os.path.realpath(fn))
+        if entry is None or entry[0] != file_stamp(fn):
+            return None
+        return entry[1]
+
+    def read(self, fn):
+        stamp = file_stamp(fn)
+        entry = self.texts.pop(os.path.realpath(fn), None)
+        if entry is not None and entry[0] == stamp:
+            text = entry[1]
+        else:
+            if entry is not None:
+                self.size -= len(entry[1])
+            with codecs.open(fn, encoding=TEXT_ENCODING) as f:
+                text = f.read()
+        return self.add(fn, text, stamp)
+
+    def add(self, fn, text, stamp=None):
+        """Add (or mark as recently used) text of fn, return text.
+
+        stamp is file_stamp(fn) when text was read (default: now).
+        """
+        if stamp is None:
+            stamp = file_stamp(fn)
+        key = os.path.realpath(fn)
+        previous = self.texts.pop(key, None)
+        if previous is not None:
+            self.size -= len(previous[1])
+        self.texts[key] = (stamp, text)    # most recently used last
+        self.size += len(text)
+        while self.size > self.max_size and len(self.texts) > 1:
+            _, evicted = self.texts.popitem(last=False)
+            self.size -= len(evicted[1])
+        return text
+
+    def resize(self, max_size):
+        self.max_size = max_size
+        while self.size > self.max_size and self.texts:
+            _, evicted = self.texts.popitem(last=False)
+            self.size -= len(evicted[1])
+
+def file_stamp(fn):
+    """Return (modification time, size) of fn, None if it is missing."""
+    try:
+        st = os.stat(fn)
+    except OSError:
+        return None
+    return st.st_mtime, st.st_size
+
+text_cache = TextCache(TEXT_CACHE_SIZE)
+
+def get_text_path(ann_fn, doc_source, options=None):
+    # Text file should be in same directory as annotation by default,
+    # other dirs can be given as options.
+    text_dir = os.path.dirname(ann_fn)
+    if options is not None and options.textdir is not None:
+        text_dir = options.textdir
+
+    return os.path.join(text_dir, os.path.basename(doc_source))
+
+def read_document_source(fn):
+    """Return the text source of Knowtator XML fn without parsing it all."""
+    for event, element in ET.iterparse(fn, events=('start',)):
+        return get_document_source(element)
+
+def get_document_text(ann_fn, doc_source, options=None):
+    fn = get_text_path(ann_fn, doc_source, options)
+    try:
+        return text_cache.read(fn)
+    except IOError, e:
+        raise IOError('Failed to find text file for %s: %s' % (ann_fn, fn))
+
+def validate(annotation, text):
+    """Check that annotation text matches text identified by its spans."""
+    validate_all([annotation], text)
+
+def validate_all(annotations, text):
+    """Check annotation texts, reporting all mismatches together."""
+    check_mismatches(span_mismatches(annotations, text))
+
+class TextMismatch(AssertionError):
+    """Annotation texts do not match the document text at their spans."""
+    def __init__(self, mismatches):
+        AssertionError.__init__(self, mismatches_message(mismatches))
+        self.mismatches = mismatches
+
+def mismatches_message(mismatches):
+    if len(mismatches) == 1:
+        message = mismatches[0]
+    else:
+        message = '%d text mismatches:\n%s' % (len(mismatches),
+                                                '\n'.join(mismatches))
+    if isinstance(message, six.text_type):
+        message = message.encode(TEXT_ENCODING)
+    return message
+
+def check_mismatches(mismatches):
+    """Raise TextMismatch with all mismatches, if there are any."""
+    if mismatches:
+        raise TextMismatch(mismatches)
+
+# Mismatches of input files skipped for them, by file, reported once
+# at the end of a run
+text_mismatches = collections.OrderedDict()
+
+def skip_mismatched(fn, error):
+    """Record TextMismatch error of fn, whose documents are not output."""
+    text_mismatches[fn] = error.mismatches
+    count('mismatches', len(error.mismatches))
+
+def take_mismatches():
+    """Return and reset mismatches of skipped files, by file."""
+    mismatches = collections.OrderedDict(text_mismatches)
+    text_mismatches.clear()
+    return mismatches
+
+def report_mismatches(out=None):
+    """Write mismatches of each skipped file, return number of files."""
+    if out is None:
+        out = sys.stderr
+    mismatches = take_mismatches()
+    for fn, m in mismatches.items():
+        print >> out, 'Error: skipped %s: %s' % (fn, mismatches_message(m))
+    return len(mismatches)
+
+def mismatch_message(annotation, text):
+    """Return message if annotation text does not match its spans."""
+    texts = []
+    for start, end in annotation.spans:
+        texts.append(text[start:end])
+    combined = ' ... '.join(texts)
+    if combined != annotation.text:
+        return 'Text mismatch:\n"%s" vs.\n"%s"' % (combined, annotation.text)
+    else:
+        return None
+
+def span_mismatches(annotations, text):
+    """Return messages for annotations with text not matching spans."""
+    np = get_numpy() if len(annotations) >= NUMPY_MIN_ANNOTATIONS else None
+    if np is None:
+        messages = (mismatch_message(a, text) for a in annotations)
+    else:
+        suspect = numpy_suspect_spans(np, annotations, text)
+        messages = (mismatch_message(annotations[i], text) for i in suspect)
+    return [m for m in messages if m is not None]
+
+def numpy_suspect_spans(np, annotations, text):
+    """Return indices of annotations that may not match text.
+
+    Checks single-span annotations in one pass over code point arrays;
+    other annotations and spans out of range are always returned.
+    """
+    single = [i for i, a in enumerate(annotations)
+              if len(a.offsets) == 2 and a.text is not None]
+    suspect = set(range(len(annotations))) - set(single)
+    if not single:
+        return sorted(suspect)
+
+    offsets = np.fromiter(itertools.chain.from_iterable(
+        annotations[i].offsets for i in single), dtype=np.int64,
+                          count=2*len(single))
+    starts, ends = offsets[0::2], offsets[1::2]
+    lengths = ends - starts
+    expected = [annotations[i].text for i in single]
+    expected_lengths = np.fromiter((len(t) for t in expected),
+                                   dtype=np.int64, count=len(single))
+    in_range = ((starts >= 0) & (ends <= len(text)) &
+                (lengths == expected_lengths))
+    suspect.update(np.asarray(single)[~in_range].tolist())
+
+    # Compare all in-range spans against the concatenated annotation texts
+    checked = np.flatnonzero(in_range)
+    starts, lengths = starts[checked], lengths[checked]
+    begins = np.cumsum(lengths) - lengths
+    positions = (np.repeat(starts - begins, lengths) +
+                 np.arange(lengths.sum(), dtype=np.int64))
+    expected = code_points(np, u''.join(expected[i] for i in checked))
+    differs = code_points(np, text)[positions] != expected
+    differences = np.concatenate(([0], np.cumsum(differs)))
+    mismatched = differences[begins + lengths] - differences[begins] > 0
+    suspect.update(np.asarray(single)[checked[mismatched]].tolist())
+    return sorted(suspect)
+
+def code_points(np, text):
+    """Return array of text units as indexed by Python strings."""
+    if sys.maxunicode > 0xffff:
+        return np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32)
+    else:
+        return np.frombuffer(text.encode('utf-16-le'), dtype=np.uint16)
+
+# The numpy module once imported by get_numpy(), False if not available
+numpy_module = None
+
+def get_numpy():
+    """Return the numpy module, or None if not available."""
+    global numpy_module
+    if numpy_module is None:
+        try:
+            import numpy
+            numpy_module = numpy
+        except ImportError:
+            numpy_module = False
+    return numpy_module or None
+
+def to_validate(annotations, options=None):
+    """Return annotations to validate per --validate mode."""
+    mode = validate_mode(options)
+    if mode == 'off':
+        return []
+    elif mode == 'sample':
+        return annotations[::VALIDATE_SAMPLE_STRIDE]
+    else:
+        return annotations
+
+def validate_mode(options=None):
+    if options is None:
+        return 'full'
+    else:
+        return options.validate
+
+def parse_tree(fn, source=None):
+    """Parse fn, return annotations, mentions, slots, doc ID and source.
+
+    Annotations refer to mentions and mentions to slots by list index.
+    """
+    tree = ET.parse(fn if source is None else source)
+    root = tree.getroot()    
+
+    doc_id = get_document_id(root)
+
+    annotations, mentions, slots = [], [], []
+    for element in root:
+        if element.tag == t_annotation:
+            annotations.append(Annotation.from_element(element))
+        elif element.tag == t_classm:
+            mentions.append(Mention.from_element(element))
+        elif element.tag in (t_boolslot, t_intslot, t_strslot, t_cmpxslot):
+            slots.append(Slot.from_element(element))
+        else:
+            raise ValueError('unexpected tag %s' % element.tag)
+
+    resolve_references(annotations, mentions, slots)
+
+    doc_source = get_document_source(root)
+    return annotations, mentions, slots, doc_id, doc_source
+
+def parse(fn, options=None, source=None):
+    cache = parse_cache(options)
+    if cache is not None:
+        key = cache.key(fn, options)
+        parsed = timed('parse', cache.load, key)
+        if parsed is not None:
+            count('parse_cache_hits')
+            count_parsed(*parsed)
+            return parsed
+
+    annotations, mentions, slots, doc_id, doc_source = timed(
+        'parse', parse_tree, fn, source)
+    count_parsed(annotations, mentions, slots)
+
+    checked = to_validate(annotations, options)
+    if checked:
+        doc_text = timed('text', get_document_text, fn, doc_source, options)
+        timed('validate', validate_all, checked, doc_text)
+
+    parsed = annotations, mentions, slots, doc_id
+    if cache is not None:
+        cache.store(key, parsed)
+    return parsed
+
+def count_parsed(annotations, mentions, slots, doc_id=None):
+    count('annotations', len(annotations))
+    count('mentions', len(mentions))
+    count('slots', len(slots))
+
+class ParseCache(object):
+    """On-disk cache of parsed and validated Knowtator XML.
+
+    Entries are keyed by hashes of the XML and text file contents and
+    the validation mode, stored as zlib-compressed marshal data, and
+    evicted least recently used first when the cache directory grows
+    larger than max_size bytes. The directory is only scanned when the
+    cache is opened, when the size of the entries found then and stored
+    since exceeds max_size, and by evict() at the end of a run.
+    """
+    def __init__(self, directory, max_size):
+        self.directory = directory
+        self.max_size = max_size
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                if not os.path.isdir(directory):    # not a creation race
+                    raise
+        self.size = self.evict()
+
+    def key(self, fn, options=None):
+        h = hashlib.sha1(PARSE_CACHE_VERSION)
+        h.update(validate_mode(options))
+        h.update(file_sha1(fn))
+        if validate_mode(options) != 'off':
+            try:
+                text_fn = get_text_path(fn, read_document_source(fn), options)
+                h.update(file_sha1(text_fn))
+            except Exception:
+                return None    # let parse() report the error
+        return h.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + PARSE_CACHE_SUFFIX)
+
+    def load(self, key):
+        if key is None:
+            return None
+        try:
+            with open(self.path(key), 'rb') as f:
+                data = f.read()
+            os.utime(self.path(key), None)    # mark as recently used
+        except (IOError, OSError):
+            return None
+        import zlib
+        import marshal
+        try:
+            return unpack_parsed(marshal.loads(zlib.decompress(data)))
+        except (ValueError, TypeError, EOFError, zlib.error):
+            return None    # corrupt entry, parse again and overwrite
+
+    def store(self, key, parsed):
+        if key is None:
+            return
+        import zlib
+        import marshal
+        data = zlib.compress(marshal.dumps(pack_parsed(parsed)), 1)
+        tmp = '%s.%d.tmp' % (self.path(key), os.getpid())
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.rename(tmp, self.path(key))
+        self.size += len(data)
+        if self.size > self.max_size:
+            self.size = self.evict()
+
+    def evict(self):
+        """Remove entries if over max_size, return size of the rest."""
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(PARSE_CACHE_SUFFIX):
+                continue
+            try:
+                st = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue    # removed by another process
+            entries.append((st.st_mtime, st.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        if total <= self.max_size:
+            return total
+        for _, size, name in sorted(entries):
+            if total <= self.max_size * PARSE_CACHE_EVICT_TO:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+            total -= size
+        return total
+
+def file_sha1(fn):
+    h = hashlib.sha1()
+    with open(fn, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(block)
+    return h.hexdigest()
+
+def pack_parsed(parsed):
+    """Return parse() result as nested tuples of primitive values."""
+    annotations, mentions, slots, doc_id = parsed
+    return (
+        [(a.mention_id, a.mention_index, a.offsets.tolist(), a.text,
+          a.annotator) for a in annotations],
+        [(m.id, m.class_id, m.class_text, m.slot_ids, m.slot_indices)
+         for m in mentions],
+        [(s.id, s.slot_id, s.value_type, s.value) for s in slots],
+        doc_id,
+    )
+
+def unpack_parsed(packed):
+    """Return parse() result from pack_parsed() output."""
+    annotations, mentions, slots, doc_id = packed
+    unpacked = []
+    for a in annotations:
+        annotation = Annotation.__new__(Annotation)
+        (annotation.mention_id, annotation.mention_index, offsets,
+         annotation.text, annotation.annotator) = a
+        annotation.offsets = array.array('l', offsets)
+        annotation.annotator = intern_string(annotation.annotator)
+        unpacked.append(annotation)
+    unpacked_mentions = []
+    for m in mentions:
+        mention = Mention(*m[:4])
+        mention.slot_indices = m[4]
+        unpacked_mentions.append(mention)
+    return (unpacked,
+            unpacked_mentions,
+            [Slot(*s) for s in slots],
+            doc_id)
+
+# Parse caches by directory, created on first use
+parse_caches = {}
+
+def parse_cache(options=None):
+    """Return ParseCache for options.parse_cache, None if not enabled."""
+    if options is None or options.parse_cache is None:
+        return None
+    directory = options.parse_cache
+    if directory not in parse_caches:
+        parse_caches[directory] = ParseCache(
+            directory, options.parse_cache_size * 1024 * 1024)
+    return parse_caches[directory]
+
+def iterconvert(fn, options=None, source=None):
+    """Parse and convert fn incrementally, yielding OA documents.
+
+    Elements are cleared once consumed, and annotations are converted
+    as soon as their mention and its slots have been seen, so memory is
+    bounded by the number of unresolved references rather than by the
+    size of the input. Documents are generated in order of resolution.
+    Annotation texts are validated in a first pass over the input, so
+    no documents are generated for a file with mismatches.
+    """
+    root, doc_id = None, None
+    pending_annotation = {}    # mention ID -> annotation
+    pending_mention = {}       # mention ID -> mention
+    slot_by_id = {}
+    mention_by_slot_id = {}    # slot ID -> mentions waiting for it
+    slot_refs = {}             # slot ID -> number of mentions using it
+    slot_tags = (t_boolslot, t_intslot, t_strslot, t_cmpxslot)
+
+    def resolved(mention):
+        return all(i in slot_by_id for i in mention.slot_ids)
+
+    def release(mention):
+        for i in mention.slot_ids:
+            slot_refs[i] -= 1
+            if slot_refs[i] == 0:
+                del slot_refs[i]
+                slot_by_id.pop(i, None)
+
+    def complete(mention_id):
+        annotation = pending_annotation.pop(mention_id)
+        mention = pending_mention.pop(mention_id)
+        slots = [slot_by_id[i] for i in mention.slot_ids]
+        document = timed('convert', convert_annotation, annotation, mention,
+                         slots, doc_id, options)
+        release(mention)
+        return document
+
+    if source is None:
+        source = fn
+    if validate_mode(options) != 'off':
+        validate_stream(fn, source, options)
+        if hasattr(source, 'seek'):
+            source.seek(0)
+
+    depth = 0
+    for event, element in ET.iterparse(source, events=('start', 'end')):
+        if event == 'start':
+            if depth == 0:
+                root = element
+                doc_id = get_document_id(root)
+            depth += 1
+            continue
+        depth -= 1
+        if depth != 1:
+            continue
+
+        ready = []
+        if element.tag == t_annotation:
+            annotation = Annotation.from_element(element)
+            count('annotations')
+            mention_id = annotation.mention_id
+            assert mention_id not in pending_annotation, \
+                'duplicate mention reference %s' % mention_id
+            pending_annotation[mention_id] = annotation
+            mention = pending_mention.get(mention_id)
+            if mention is not None and resolved(mention):
+                ready.append(mention_id)
+        elif element.tag == t_classm:
+            mention = Mention.from_element(element)
+            count('mentions')
+            pending_mention[mention.id] = mention
+            for i in mention.slot_ids:
+                slot_refs[i] = slot_refs.get(i, 0) + 1
+                if i not in slot_by_id:
+                    mention_by_slot_id.setdefault(i, []).append(mention.id)
+            if mention.id in pending_annotation and resolved(mention):
+                ready.append(mention.id)
+        elif element.tag in slot_tags:
+            slot = Slot.from_element(element)
+            count('slots')
+            slot_by_id[slot.id] = slot
+            for mention_id in mention_by_slot_id.pop(slot.id, []):
+                mention = pending_mention[mention_id]
+                if (mention_id in pending_annotation and
+                    mention_id not in ready and resolved(mention)):
+                    ready.append(mention_id)
+            if slot.id not in slot_refs:
+                # referenced by a mention not yet seen, or not at all
+                slot_refs[slot.id] = 0
+        else:
+            raise ValueError('unexpected tag %s' % element.tag)
+
+        element.clear()
+        root.clear()
+        for mention_id in ready:
+            yield complete(mention_id)
+
+    # There should be exactly one mention for each annotation.
+    assert not pending_annotation and not pending_mention, \
+        'unresolved mentions: %s' % ' '.join(sorted(
+            set(pending_annotation.keys()) ^ set(pending_mention.keys())))
+
+def validate_stream(fn, source, options=None):
+    """Check annotation texts of fn in an incremental pass over source.
+
+    Raise TextMismatch with all mismatches found, so that iterconvert()
+    generates no documents for a file that fails validation.
+    """
+    if validate_mode(options) == 'sample':
+        stride = VALIDATE_SAMPLE_STRIDE
+    else:
+        stride = 1
+    root, doc_text, mismatches, n, depth = None, None, [], 0, 0
+    for event, element in ET.iterparse(source, events=('start', 'end')):
+        if event == 'start':
+            if depth == 0:
+                root = element
+                doc_text = timed('text', get_document_text, fn,
+                                 get_document_source(root), options)
+            depth += 1
+            continue
+        depth -= 1
+        if depth != 1:
+            continue
+        if element.tag == t_annotation:
+            if n % stride == 0:
+                message = timed('validate', mismatch_message,
+                                Annotation.from_element(element), doc_text)
+                if message is not None:
+                    mismatches.append(message)
+            n += 1
+        element.clear()
+        root.clear()
+    check_mismatches(mismatches)
+
+def output_format(options=None):
+    if options is None:
+        return 'pretty'
+    else:
+        return options.format
+
+def rdf_output(options=None):
+    return output_format(options) in RDF_FORMATS
+
+def minify_context(context):
+    """Return context (JSON object members) serialized without spaces."""
+    parsed = json.loads('{%s}' % context,
+                        object_pairs_hook=collections.OrderedDict)
+    return json.dumps(parsed, separators=(',',':'))
+
+def write_header(out, options=None, context=None):
+    if context is None:
+        if options is None or not options.compact:
+            context = oa_recommended_context
+        else:
+            context = get_compact_context()
+
+    format_ = output_format(options)
+    if format_ in RDF_FORMATS:
+        pass
+    elif format_ == 'minified':
+        out.write('{"@context":%s,"@graph":[' % minify_context(context))
+    elif format_ == 'jsonl':
+        out.write('{"@context":%s}\n' % minify_context(context))
+    else:
+        print >> out, '''{
+  "@context": {
+    %s
+  },
+  "@graph": [''' % context
+
+def write_footer(out, options=None):
+    format_ = output_format(options)
+    if format_ == 'minified':
+        out.write(']}\n')
+    elif format_ == 'jsonl' or format_ in RDF_FORMATS:
+        pass
+    else:
+        print >> out, '''
+  ]
+}'''
+
+def serialize(document, options=None):
+    """Return document serialized for output in format of options."""
+    format_ = output_format(options)
+    if format_ == 'minified':
+        return json.dumps(document, sort_keys=True, separators=(',',':'))
+    elif format_ == 'jsonl':
+        return json.dumps(document, sort_keys=True, separators=(',',':'))+'\n'
+    elif format_ in RDF_FORMATS:
+        return serialize_rdf(document, format_ == 'nq')
+    else:
+        return pretty_print(document, 5)
+
+rdf_type = 'http://www.w3.org/1999/02/22-rdf-syntax-ns#type'
+oa_ns = 'http://www.w3.org/ns/oa#'
+xsd_nonNegativeInteger = 'http://www.w3.org/2001/XMLSchema#nonNegativeInteger'
+
+# Absolute IRI that can be written as an N-Triples IRI reference
+rdf_iri_re = re.compile(r'^[A-Za-z][A-Za-z0-9+.-]*:[^\x00-\x20<>"{}|\\^`]*$')
+
+# Characters escaped in N-Triples string literals: quote, backslash and
+# anything outside printable ASCII (surrogate pairs on narrow builds)
+rdf_literal_escape_re = re.compile(
+    u'[\ud800-\udbff][\udc00-\udfff]|[^\x20-\x7e]|["\\\\]')
+
+rdf_literal_echars = {
+    u'"': '\\"',
+    u'\\': '\\\\',
+    u'\n': '\\n',
+    u'\r': '\\r',
+    u'\t': '\\t',
+}
+
+def rdf_literal_escape(m):
+    c = m.group(0)
+    if c in rdf_literal_echars:
+        return rdf_literal_echars[c]
+    elif len(c) == 2:
+        code = 0x10000 + ((ord(c[0]) - 0xd800) << 10) + (ord(c[1]) - 0xdc00)
+    else:
+        code = ord(c)
+    if code > 0xffff:
+        return '\\U%08X' % code
+    else:
+        return '\\u%04X' % code
+
+def rdf_literal(value):
+    """Return value as an ASCII N-Triples string literal."""
+    if not isinstance(value, six.text_type):
+        value = value.decode('utf-8')
+    return '"%s"' % str(rdf_literal_escape_re.sub(rdf_literal_escape, value))
+
+def rdf_term(value):
+    """Return N-Triples term for value, an IRI if possible."""
+    if rdf_iri_re.match(value):
+        return '<%s>' % value.encode('utf-8')
+    else:
+        # e.g. IDs that failed to map; keep them as string literals
+        return rdf_literal(value)
+
+def serialize_rdf(document, quads=False):
+    """Return N-Triples (N-Quads if quads) statements for OA document.
+
+    With quads, statements are placed in a graph named by the source
+    document of the annotation. Expanded targets (-e) are written as
+    oa:SpecificResource blank nodes with an oa:TextPositionSelector,
+    labeled after the annotation ID so that they are unique in output
+    concatenated from any number of files.
+    """
+    id_ = rdf_term(document[oa_id])
+    targets = document[oa_hasTarget]
+    if not isinstance(targets, list):
+        targets = [targets]
+    bodies = document[oa_hasBody]
+    if not isinstance(bodies, list):
+        bodies = [bodies]
+    if quads:
+        source = targets[0]
+        if isinstance(source, dict):
+            source = source[oa_hasSource]
+        graph = ' ' + rdf_term(source.split('#', 1)[0])
+    else:
+        graph = ''
+
+    statements = []
+    def add(s, p, o):
+        statements.append('%s <%s> %s%s .\n' % (s, p, o, graph))
+
+    add(id_, rdf_type, '<%sAnnotation>' % oa_ns)
+    node = None
+    for i, target in enumerate(targets):
+        if not isinstance(target, dict):
+            add(id_, oa_ns + 'hasTarget', rdf_term(target))
+            continue
+        if node is None:
+            node = '_:b' + sha1(document[oa_id].encode('utf-8'))[:20]
+        resource, selector = '%st%d' % (node, i), '%ss%d' % (node, i)
+        add(id_, oa_ns + 'hasTarget', resource)
+        add(resource, rdf_type, '<%sSpecificResource>' % oa_ns)
+        add(resource, oa_ns + 'hasSource', rdf_term(target[oa_hasSource]))
+        add(resource, oa_ns + 'hasSelector', selector)
+        add(selector, rdf_type, '<%sTextPositionSelector>' % oa_ns)
+        for key in (oa_start, oa_end):
+            add(selector, oa_ns + key, '"%d"^^<%s>' % (
+                target[oa_hasSelector][key], xsd_nonNegativeInteger))
+    for body in bodies:
+        add(id_, oa_ns + 'hasBody', rdf_term(body))
+    add(id_, oa_ns + 'annotatedBy', rdf_term(document[oa_annotatedBy]))
+    return ''.join(statements)
+
+def document_separator(options=None):
+    """Return string separating serialized documents in output."""
+    format_ = output_format(options)
+    if format_ == 'minified':
+        return ','
+    elif format_ == 'jsonl' or format_ in RDF_FORMATS:
+        return ''
+    else:
+        return ',\n'
+
+class BufferedOutput(object):
+    """Collect writes to out into chunks of at least size characters."""
+    def __init__(self, out, size=OUTPUT_BUFFER_SIZE):
+        self.out = out
+        self.size = size
+        self.parts = []
+        self.buffered = 0
+
+    def write(self, s):
+        self.parts.append(s)
+        self.buffered += len(s)
+        if self.buffered >= self.size:
+            self.flush()
+
+    def flush(self):
+        if self.parts:
+            data = ''.join(self.parts)
+            self.out.write(data)
+            count_output(data)
+            self.parts = []
+            self.buffered = 0
+        self.out.flush()
+
+    close = flush
+
+class AsyncOutput(BufferedOutput):
+    """Write chunks of buffered output to out in a writer thread.
+
+    At most depth chunks are queued; writes block when the queue is
+    full. Errors in the writer thread are raised on the next write,
+    flush or close.
+    """
+    def __init__(self, out, depth, size=OUTPUT_BUFFER_SIZE):
+        import Queue
+        import threading
+        super(AsyncOutput, self).__init__(out, size)
+        self.queue = Queue.Queue(maxsize=max(depth, 1))
+        self.error = None
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        while True:
+            chunk = self.queue.get()
+            try:
+                if chunk is None:
+                    return
+                if self.error is None:
+                    self.out.write(chunk)
+            except Exception:
+                self.error = sys.exc_info()
+            finally:
+                self.queue.task_done()
+
+    def check(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            six.reraise(*error)
+
+    def flush(self):
+        self.check()
+        if self.parts:
+            self.put(''.join(self.parts))
+            self.parts = []
+            self.buffered = 0
+        self.queue.join()
+        self.check()
+        self.out.flush()
+
+    def write(self, s):
+        self.parts.append(s)
+        self.buffered += len(s)
+        if self.buffered >= self.size:
+            self.check()
+            self.put(''.join(self.parts))
+            self.parts = []
+            self.buffered = 0
+
+    def put(self, data):
+        count_output(data)
+        self.queue.put(data)
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self.queue.put(None)
+            self.thread.join()
+
+class TextReads(object):
+    """Text file reads shared by reader threads.
+
+    Texts are taken from text_cache if present, and each text is read
+    only once while in use, however many inputs refer to it (e.g. the
+    layers of a combined article). read() and release() are paired.
+    """
+    def __init__(self):
+        import threading
+        self.lock = threading.Lock()
+        self.event = threading.Event
+        self.reads = {}    # path: [read done event, text, number of users]
+
+    def read(self, fn):
+        """Return text of fn, or None if it cannot be read."""
+        key = os.path.realpath(fn)
+        with self.lock:
+            entry = self.reads.get(key)
+            is_reader = entry is None
+            if is_reader:
+                entry = self.reads[key] = [self.event(), None, 0]
+            entry[2] += 1
+        if is_reader:
+            try:
+                entry[1] = text_cache.peek(fn)
+                if entry[1] is None:
+                    with codecs.open(fn, encoding=TEXT_ENCODING) as f:
+                        entry[1] = f.read()
+            except Exception:
+                pass    # reported on conversion
+            finally:
+                entry[0].set()
+        else:
+            entry[0].wait()
+        return entry[1]
+
+    def release(self, fn):
+        key = os.path.realpath(fn)
+        with self.lock:
+            entry = self.reads[key]
+            entry[2] -= 1
+            if entry[2] == 0:
+                del self.reads[key]
+
+def read_input(job):
+    """Reader stage: return fn, its XML content, text path and text.
+
+    The text is read through reads (TextReads), which the caller must
+    release for the returned text path if it is not None.
+    """
+    import io
+    fn, options, reads = job
+    with open(fn, 'rb') as f:
+        xml = f.read()
+    text_fn, text = None, None
+    if validate_mode(options) != 'off':
+        try:
+            source = read_document_source(io.BytesIO(xml))
+            text_fn = get_text_path(fn, source, options)
+        except Exception:
+            return fn, xml, None, None    # reported on conversion
+        text = reads.read(text_fn)
+    return fn, xml, text_fn, text
+
+def prefetch_inputs(files, options):
+    """Generate read_input() results for files in order, reading ahead.
+
+    Up to options.prefetch files are read concurrently by reader
+    threads while earlier ones are converted. A text is kept shared
+    until the consumer has taken the input using it and resumes, by
+    which time it has been added to text_cache.
+    """
+    from multiprocessing.pool import ThreadPool
+    pool = ThreadPool(options.prefetch)
+    reads = TextReads()
+    try:
+        files = iter(files)
+        pending = collections.deque(
+            pool.apply_async(read_input, [(fn, options, reads)])
+            for fn in itertools.islice(files, options.prefetch))
+        while pending:
+            result = pending.popleft().get()
+            for fn in itertools.islice(files, 1):
+                pending.append(pool.apply_async(read_input,
+                                                [(fn, options, reads)]))
+            yield result
+            if result[2] is not None:
+                reads.release(result[2])
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+def iter_converted(fn, options=None, source=None):
+    """Generate OA documents converted from fn.
+
+    If given, source is a file object to read the XML of fn from.
+    """
+    if stats is not None:
+        stats.start_file(fn)
+    profiler = start_profile(fn, options)
+    try:
+        if options is not None and options.stream:
+            start = time.time()
+            for c in iterconvert(fn, options, source):
+                yield c
+            # Parsing is interleaved with the other phases when streaming
+            if stats is not None:
+                phases = stats.current['time']
+                interleaved = ('text', 'validate', 'convert', 'output')
+                stats.add_time('parse', time.time() - start - sum(
+                    phases[p] for p in interleaved))
+        else:
+            parsed = parse(fn, options, source)
+            for c in timed('convert', convert, *parsed, options=options):
+                yield c
+    except TextMismatch, e:
+        skip_mismatched(fn, e)
+    except:
+        print >> sys.stderr, 'Failed to parse %s' % fn
+        raise
+    finally:
+        finish_profile(profiler, options)
+
+def iter_serialized(fn, options=None, source=None):
+    """Generate serialized OA documents converted from fn."""
+    return serialize_documents(iter_converted(fn, options, source), options)
+
+def serialize_documents(documents, options=None):
+    for c in documents:
+        if span_index is not None:
+            span_index.add(c)
+        yield timed('output', serialize, c, options)
+
+def iter_layer(fn, layer, options=None):
+    """Generate (merge key, document) for fn in document order.
+
+    Knowtator XML is not ordered by offset, so the layer is parsed and
+    its annotations sorted; documents are converted lazily.
+    """
+    if stats is not None:
+        stats.start_file(fn)
+    try:
+        annotations, mentions, slots, doc_id = parse(fn, options)
+    except TextMismatch, e:
+        skip_mismatched(fn, e)
+        return
+    except:
+        print >> sys.stderr, 'Failed to parse %s' % fn
+        raise
+    def position(i):
+        offsets = annotations[i].offsets
+        return min(offsets[0::2]), max(offsets[1::2])
+    for seq, i in enumerate(sorted(range(len(annotations)), key=position)):
+        annotation = annotations[i]
+        mention = mentions[annotation.mention_index]
+        document = timed('convert', convert_annotation, annotation, mention,
+                         mention_slots(mention, slots), doc_id, options)
+        yield (doc_id,) + position(i) + (layer, seq), document
+
+def iter_merged(files, options=None):
+    """Generate OA documents from files merged in document order.
+
+    The files are taken as annotation layers, k-way merged by document
+    and span start, dropping annotations with an ID already seen at the
+    same position. Duplicates share their targets and hence their merge
+    position, so only IDs at the current position are remembered.
+
+    Each layer is parsed, converted and spilled to a temporary file in
+    document order in turn, so only one layer is in memory at a time,
+    and the merge holds one document per layer.
+    """
+    import tempfile
+    spills = []
+    try:
+        for i, fn in enumerate(files):
+            spills.append(tempfile.TemporaryFile())
+            spill_layer(iter_layer(fn, i, options), spills[-1])
+        position, seen = None, set()
+        for key, document in heapq.merge(*map(iter_spilled, spills)):
+            if stats is not None:
+                stats.start_file(files[key[3]])    # charge output to layer
+            if key[:2] != position:
+                position, seen = key[:2], set()
+            if document[oa_id] in seen:
+                count('duplicates')
+                continue
+            seen.add(document[oa_id])
+            yield document
+    finally:
+        for f in spills:
+            f.close()
+
+def spill_layer(items, f):
+    """Write (merge key, document) items to file f."""
+    import marshal
+    for item in items:
+        marshal.dump(item, f)
+
+def iter_spilled(f):
+    """Generate items written to f by spill_layer()."""
+    import marshal
+    f.seek(0)
+    while True:
+        try:
+            yield marshal.load(f)
+        except EOFError:
+            return
+
+def start_profile(fn, options=None):
+    """Return running profiler if fn is the file chosen for --profile."""
+    if options is None or options.profile is None:
+        return None
+    if os.path.realpath(fn) != os.path.realpath(options.profile):
+        return None
+    import cProfile
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+def finish_profile(profiler, options):
+    if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(options.profile_out)
+
+def write_serialized(serialized, out, is_first=True, separator=',\n'):
+    """Write serialized documents to out, return number written."""
+    i = -1
+    for i, s in enumerate(serialized):
+        if not is_first or i != 0:
+            out.write(separator)
+            count_file_output(separator)
+        out.write(s)
+        count_file_output(s)
+    return i + 1
+
+def process(fn, options=None, is_first=True, out=None, source=None):
+    """Convert fn and write its documents to out, return number written."""
+    if out is None:
+        out = sys.stdout
+    serialized = iter_serialized(fn, options, source)
+    return write_serialized(serialized, out, is_first,
+                            document_separator(options))
+
+def serialize_file(job):
+    """Process pool worker: return serialized documents for (fn, options)."""
+    fn, options = job
+    return list(iter_serialized(fn, options)), take_worker_state()
+
+def process_pool_size(options):
+    """Return number of worker processes for options.jobs."""
+    jobs = getattr(options, 'jobs', 1)
+    if jobs is None:
+        return 1
+    elif jobs < 1:
+        import multiprocessing
+        return multiprocessing.cpu_count()
+    else:
+        return jobs
+
+def process_pool(options):
+    """Return process pool for options.jobs workers, None if serial."""
+    jobs = process_pool_size(options)
+    if jobs == 1:
+        return None
+    import multiprocessing
+    return multiprocessing.Pool(jobs)
+
+def process_all(files, options=None, out=None):
+    """Convert files into a single JSON-LD graph written to out."""
+    if out is None:
+        out = sys.stdout
+    if prefetch_depth(options) > 0:
+        out = AsyncOutput(out, prefetch_depth(options))
+    else:
+        out = BufferedOutput(out)
+    try:
+        process_files(files, options, out)
+    finally:
+        out.close()
+
+def prefetch_depth(options=None):
+    if options is None or process_pool_size(options) != 1:
+        return 0
+    else:
+        return options.prefetch
+
+def process_files(files, options, out):
+    separator = document_separator(options)
+    write_header(out, options)
+    if options is not None and options.merge:
+        serialized = serialize_documents(iter_merged(files, options), options)
+        write_serialized(serialized, out, True, separator)
+        write_footer(out, options)
+        return
+    pool = process_pool(options)
+    is_first = True
+    if pool is None and prefetch_depth(options) > 0:
+        import io
+        # Pipeline: reader threads, conversion here, writer thread
+        for fn, xml, text_fn, text in prefetch_inputs(files, options):
+            if text is not None:
+                text_cache.add(text_fn, text)
+            if process(fn, options, is_first, out, io.BytesIO(xml)):
+                is_first = False
+    elif pool is None:
+        for fn in files:
+            if process(fn, options, is_first, out):
+                is_first = False
+    else:
+        # imap() returns results in input order, keeping output identical
+        # to serial processing.
+        try:
+            jobs = [(fn, options) for fn in files]
+            results = pool.imap(serialize_file, jobs)
+            for fn, (serialized, state) in zip(files, results):
+                merge_worker_state(state)
+                if stats is not None:
+                    stats.start_file(fn)
+                if write_serialized(serialized, out, is_first, separator):
+                    is_first = False
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+    write_footer(out, options)
+
+class ShardWriter(object):
+    """Write documents into gzip-compressed shards with an offset index.
+
+    Each shard is a complete JSON-LD (or JSON Lines) file. The header,
+    the annotations of each input file and the footer are written as
+    separate gzip members, so a document can be read by decompressing
+    only its members, located by the index in SHARD_INDEX_FILE. Shard
+    limits are checked before each annotation, so the annotations of
+    one input file may be split across shards, one member in each. The
+    compressed size lags behind by what the compressor has buffered.
+    """
+    def __init__(self, directory, options):
+        self.directory = directory
+        self.options = options
+        self.separator = document_separator(options)
+        self.shards = []
+        self.documents = collections.OrderedDict()
+        self.raw = None
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def open_shard(self):
+        name = 'shard-%05d%s' % (len(self.shards), shard_suffix(self.options))
+        self.shards.append(name)
+        self.raw = open(os.path.join(self.directory, name), 'wb')
+        self.annotations = 0
+        self.is_first = True
+        self.write_member(lambda out: write_header(out, self.options))
+
+    def close_shard(self):
+        self.write_member(lambda out: write_footer(out, self.options))
+        self.raw.close()
+        self.raw = None
+
+    def full(self):
+        max_annotations = self.options.shard_annotations
+        max_bytes = self.options.shard_bytes
+        return ((max_annotations and self.annotations >= max_annotations) or
+                (max_bytes and self.raw.tell() >= max_bytes))
+
+    def start_member(self):
+        """Return gzip file writing a new member to the current shard."""
+        import gzip
+        self.member_offset = self.raw.tell()
+        return gzip.GzipFile(fileobj=self.raw, mode='wb')
+
+    def end_member(self, out):
+        """Close member written by out, return its offset and length."""
+        out.close()
+        length = self.raw.tell() - self.member_offset
+        if stats is not None:
+            stats.output_bytes += length    # compressed
+        return self.member_offset, length
+
+    def write_member(self, write):
+        """Write a gzip member with write(out), return offset and length."""
+        out = self.start_member()
+        try:
+            write(out)
+        finally:
+            offset, length = self.end_member(out)
+        return offset, length
+
+    def add(self, doc_id, serialized):
+        """Add serialized annotations of one input file of doc_id.
+
+        Return the number of annotations written.
+        """
+        written, out = 0, None
+        try:
+            for s in serialized:
+                if self.raw is None or self.full():
+                    if out is not None:
+                        self.index_member(doc_id, out)
+                        out = None
+                    if self.raw is not None:
+                        self.close_shard()
+                    self.open_shard()
+                if out is None:
+                    out = self.start_member()
+                written += write_serialized([s], out, self.is_first,
+                                            self.separator)
+                self.is_first = False
+                self.annotations += 1
+        finally:
+            if out is not None:
+                self.index_member(doc_id, out)
+        return written
+
+    def index_member(self, doc_id, out):
+        offset, length = self.end_member(out)
+        entry = [len(self.shards) - 1, offset, length]
+        self.documents.setdefault(doc_id, []).append(entry)
+
+    def close(self):
+        if self.raw is None:
+            self.open_shard()    # always write at least one valid shard
+        self.close_shard()
+        index = {
+            'format': output_format(self.options),
+            'shards': self.shards,
+            'documents': self.documents,
+        }
+        with open(os.path.join(self.directory, SHARD_INDEX_FILE), 'w') as f:
+            json.dump(index, f, indent=1, separators=(',', ': '))
+
+def shard_suffix(options):
+    if output_format(options) == 'jsonl':
+        return '.jsonl.gz'
+    elif rdf_output(options):
+        return '.%s.gz' % output_format(options)
+    else:
+        return '.jsonld.gz'
+
+def write_shards(files, options):
+    """Convert files into gzip-compressed shards in options.shards."""
+    writer = ShardWriter(options.shards, options)
+    pool = process_pool(options)
+    try:
+        if pool is None:
+            for fn in files:
+                writer.add(source_document_id(read_document_source(fn)),
+                           iter_serialized(fn, options))
+        else:
+            try:
+                jobs = [(fn, options) for fn in files]
+                results = pool.imap(serialize_file, jobs)
+                for fn, (serialized, state) in zip(files, results):
+                    merge_worker_state(state)
+                    if stats is not None:
+                        stats.start_file(fn)
+                    writer.add(source_document_id(read_document_source(fn)),
+                               serialized)
+                pool.close()
+            finally:
+                pool.terminate()
+                pool.join()
+    finally:
+        writer.close()
+
+def read_shard_document(directory, doc_id):
+    """Return OA documents of doc_id from shards written to directory.
+
+    For N-Triples and N-Quads shards, return the statement lines.
+    """
+    with open(os.path.join(directory, SHARD_INDEX_FILE)) as f:
+        index = json.load(f)
+    documents = []
+    for shard, offset, length in index['documents'].get(doc_id, []):
+        with open(os.path.join(directory, index['shards'][shard]), 'rb') as f:
+            f.seek(offset)
+            data = f.read(length)
+        import zlib
+        text = zlib.decompressobj(16 + zlib.MAX_WBITS).decompress(data)
+        if index['format'] == 'jsonl':
+            documents.extend(json.loads(l) for l in text.splitlines() if l)
+        elif index['format'] in RDF_FORMATS:
+            documents.extend(l for l in text.splitlines() if l)
+        else:
+            text = text.lstrip().lstrip(',')
+            documents.extend(json.loads('[%s]' % text))
+    return documents
+
+def target_spans(document):
+    """Return (source, start, end) for the targets of an OA document."""
+    targets = document[oa_hasTarget]
+    if not isinstance(targets, list):
+        targets = [targets]
+    spans = []
+    for target in targets:
+        if isinstance(target, dict):
+            selector = target[oa_hasSelector]
+            spans.append((target[oa_hasSource], selector[oa_start],
+                           selector[oa_end]))
+        else:
+            source, frag = target.split('#', 1)
+            start, end = parse_frag(frag)
+            spans.append((source, start, end))
+    return spans
+
+class SpanIndexBuilder(object):
+    """Collect annotation target spans for writing a SpanIndex file."""
+    def __init__(self):
+        self.annotations = []    # [ID, body] by annotation index
+        self.spans = collections.OrderedDict()    # document: records
+
+    def add(self, document):
+        i = len(self.annotations)
+        self.annotations.append([document[oa_id], document[oa_hasBody]])
+        for source, start, end in target_spans(document):
+            self.spans.setdefault(source, []).append((start, end, i))
+
+    def take(self):
+        """Return and reset collected spans."""
+        taken = self.annotations, self.spans
+        self.annotations, self.spans = [], collections.OrderedDict()
+        return taken
+
+    def merge(self, taken):
+        annotations, spans = taken
+        base = len(self.annotations)
+        self.annotations.extend(annotations)
+        for source, records in spans.items():
+            self.spans.setdefault(source, []).extend(
+                (s, e, base + i) for s, e, i in records)
+
+    def write(self, fn):
+        """Write index: header, JSON directory, span records, annotations.
+
+        Records are (start, end, annotation index, subtree maximum end)
+        quadruples of signed 64-bit little-endian integers, sorted by
+        start per document. A document's records form an implicit
+        binary search tree (the middle record of a range is its root)
+        whose nodes hold the maximum end in their subtree. Annotations
+        are [ID, body] JSON arrays, located by an array of offsets.
+        """
+        documents, records = {}, []
+        for source, spans in self.spans.items():
+            spans = sorted(spans)
+            documents[source] = [len(records), len(spans)]
+            records.extend(subtree_max_ends(spans))
+        annotations = [json.dumps(a, separators=(',', ':'))
+                       for a in self.annotations]
+        offsets = [0]
+        for a in annotations:
+            offsets.append(offsets[-1] + len(a))
+        directory = json.dumps({
+            'documents': documents,
+            'records': len(records),
+            'annotations': len(annotations),
+        }, separators=(',', ':'))
+        directory += ' ' * (-len(directory) % 8)    # align records
+        import struct
+        with open(fn, 'wb') as f:
+            f.write(SPAN_INDEX_MAGIC)
+            f.write(struct.pack('<Q', len(directory)))
+            f.write(directory)
+            write_int64s(f, itertools.chain.from_iterable(records))
+            write_int64s(f, offsets)
+            for a in annotations:
+                f.write(a)
+
+def subtree_max_ends(spans):
+    """Return (start, end, annotation, subtree max end) for sorted spans."""
+    max_ends = [None] * len(spans)
+    def build(lo, hi):
+        if lo >= hi:
+            return -1
+        mid = (lo + hi) // 2
+        max_ends[mid] = max(spans[mid][1], build(lo, mid), build(mid+1, hi))
+        return max_ends[mid]
+    build(0, len(spans))
+    return [span + (m, ) for span, m in zip(spans, max_ends)]
+
+def write_int64s(f, values):
+    """Write values as signed 64-bit little-endian integers to f."""
+    values = list(values)
+    if array.array('l').itemsize == 8 and sys.byteorder == 'little':
+        f.write(array.array('l', values).tostring())
+    else:
+        import struct
+        f.write(struct.pack('<%dq' % len(values), *values))
+
+class SpanIndex(object):
+    """Memory-mapped span index written by --span-index.
+
+    Queries find annotations of a document by character range in time
+    logarithmic in the number of spans in the document (plus matches).
+    Annotation IDs and bodies are only read for matches.
+    """
+    def __init__(self, fn):
+        import mmap
+        import struct
+        # (start, end, annotation, subtree max end) and offset pairs
+        self.record = struct.Struct('<qqqq')
+        self.offsets = struct.Struct('<qq')
+        self.file = open(fn, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic = self.map[:len(SPAN_INDEX_MAGIC)]
+        if magic != SPAN_INDEX_MAGIC:
+            raise ValueError('%s: not a span index' % fn)
+        length, = struct.unpack_from('<Q', self.map, len(SPAN_INDEX_MAGIC))
+        start = len(SPAN_INDEX_MAGIC) + 8
+        directory = json.loads(self.map[start:start+length])
+        self.documents = directory['documents']
+        self.num_annotations = directory['annotations']
+        self.records_offset = start + length
+        self.offsets_offset = (self.records_offset +
+                               directory['records'] * self.record.size)
+        self.annotations_offset = (self.offsets_offset +
+                                   8 * (self.num_annotations + 1))
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def span(self, i):
+        return self.record.unpack_from(self.map, self.records_offset +
+                                       i * self.record.size)
+
+    def annotation(self, i):
+        """Return [ID, body] of annotation i."""
+        start, end = self.offsets.unpack_from(self.map,
+                                              self.offsets_offset + 8 * i)
+        return json.loads(self.map[self.annotations_offset + start:
+                                   self.annotations_offset + end])
+
+    def bisect(self, lo, hi, value, right=False):
+        """Return first index in [lo, hi) with start >= value (> if right)."""
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = self.span(mid)[0]
+            if start < value or (right and start == value):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def search(self, lo, hi, min_end, max_start, found):
+        """Append annotations of records in [lo, hi) to found in order.
+
+        Matches have end >= min_end and start <= max_start; subtrees
+        with a smaller maximum end are skipped.
+        """
+        while lo < hi:
+            mid = (lo + hi) // 2
+            s, e, a, max_end = self.span(mid)
+            if max_end < min_end:
+                return
+            self.search(lo, mid, min_end, max_start, found)
+            if s > max_start:
+                return
+            if e >= min_end:
+                found.append(a)
+            lo = mid + 1
+
+    def query(self, document, start, end, mode='overlap'):
+        """Return [ID, body] of annotations of document matching range.
+
+        Modes: overlap (annotation span overlaps [start, end)), within
+        (span inside the range) and covers (span covers the range).
+        """
+        if document not in self.documents:
+            document = compact(document, compact_prefix_map)
+        if document not in self.documents:
+            return []
+        first, n = self.documents[document]
+        matches = []
+        if mode == 'overlap':
+            self.search(first, first+n, start + 1, end - 1, matches)
+        elif mode == 'within':
+            lo = self.bisect(first, first+n, start)
+            hi = self.bisect(lo, first+n, end, right=True)
+            for i in range(lo, hi):
+                s, e, a, _ = self.span(i)
+                if e <= end:
+                    matches.append(a)
+        elif mode == 'covers':
+            self.search(first, first+n, end, start, matches)
+        else:
+            raise ValueError('unknown query mode %s' % mode)
+        found, seen = [], set()
+        for a in matches:
+            if a not in seen:
+                seen.add(a)
+                found.append(self.annotation(a))
+        return found
+
+def corpus_jobs(corpus_root, combined=False, extension='.jsonld'):
+    """Return (output path, input files) pairs for a CRAFT corpus.
+
+    Output paths are relative to the output directory and follow the
+    layouts of convert-craft.sh and convert-craft-combined.sh.
+    """
+    indir = os.path.join(corpus_root, CRAFT_XML_DIR)
+    suffix = '.txt.knowtator.xml'
+    jobs = []
+    if not combined:
+        for d in sorted(os.listdir(indir)):
+            if not os.path.isdir(os.path.join(indir, d)):
+                continue
+            for f in sorted(os.listdir(os.path.join(indir, d))):
+                o = os.path.join(d, basename_without(f, suffix) + extension)
+                jobs.append((o, [os.path.join(indir, d, f)]))
+    else:
+        layers = [d for d in craft_combined_layers
+                  if os.path.isdir(os.path.join(indir, d))]
+        names = set()
+        for d in layers:
+            names.update(f for f in os.listdir(os.path.join(indir, d))
+                         if f.endswith('.xml'))
+        for f in sorted(names):
+            files = [os.path.join(indir, d, f) for d in layers]
+            files = [fn for fn in files if os.path.exists(fn)]
+            jobs.append((basename_without(f, suffix) + extension, files))
+    return jobs
+
+def corpus_extension(options):
+    if rdf_output(options):
+        return '.' + output_format(options)
+    else:
+        return '.jsonld'
+
+def basename_without(fn, suffix):
+    fn = os.path.basename(fn)
+    if fn.endswith(suffix):
+        fn = fn[:-len(suffix)]
+    return fn
+
+def convert_corpus_job(job):
+    """Convert files into output file o for job (o, files, options).
+
+    Return False if files were skipped for text mismatches.
+    """
+    o, files, options = job
+    print >> sys.stderr, 'Converting %s into %s ...' % (' '.join(files), o)
+    with open(o, 'w') as out:
+        process_all(files, options, out)
+    return not any(fn in text_mismatches for fn in files)
+
+def convert_corpus_worker(job):
+    """Process pool worker for convert_corpus_job()."""
+    return convert_corpus_job(job), take_worker_state()
+
+def file_fingerprint(fn):
+    try:
+        st = os.stat(fn)
+    except OSError:
+        return [fn, None, None]
+    return [fn, st.st_mtime, st.st_size]
+
+def build_record(files, options):
+    """Return manifest record of the inputs and options for an output."""
+    inputs = []
+    for fn in files:
+        try:
+            text_fn = get_text_path(fn, read_document_source(fn), options)
+        except Exception:
+            text_fn = None    # fails on conversion, never up to date
+        inputs.append([file_fingerprint(fn), file_fingerprint(text_fn)
+                       if text_fn is not None else None])
+    return {
+        'inputs': inputs,
+        'options': dict((o, getattr(options, o)) for o in manifest_options),
+    }
+
+def read_manifest(outdir):
+    fn = os.path.join(outdir, MANIFEST_FILE)
+    if not os.path.exists(fn):
+        return {}
+    try:
+        with open(fn) as f:
+            return json.load(f)
+    except ValueError:
+        print >> sys.stderr, 'Warning: ignoring invalid manifest %s' % fn
+        return {}
+
+def write_manifest(outdir, manifest):
+    fn = os.path.join(outdir, MANIFEST_FILE)
+    with open(fn + '.tmp', 'w') as f:
+        json.dump(manifest, f, sort_keys=True, indent=1)
+    os.rename(fn + '.tmp', fn)
+
+def convert_corpus(options):
+    """Convert a CRAFT corpus into options.out, one file per article.
+
+    Outputs whose inputs and options are unchanged since the previous
+    run, as recorded in the manifest in options.out, are skipped.
+    """
+    indir = os.path.join(options.corpus, CRAFT_XML_DIR)
+    if options.textdir is None:
+        options.textdir = os.path.join(options.corpus, CRAFT_TEXT_DIR)
+    for d in (indir, options.textdir):
+        if not os.path.isdir(d):
+            print >> sys.stderr, '%s: not a directory' % d
+            return 1
+    if not os.path.isdir(options.out):
+        os.makedirs(options.out)
+
+    previous = {} if options.force else read_manifest(options.out)
+    manifest = {}
+    jobs, skipped = [], 0
+    for o, files in corpus_jobs(options.corpus, options.combined,
+                                corpus_extension(options)):
+        record = build_record(files, options)
+        if previous.get(o) == record and \
+                os.path.exists(os.path.join(options.out, o)):
+            manifest[o] = record
+            skipped += 1
+            continue
+        path = os.path.join(options.out, o)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        jobs.append((path, files, options, o, record))
+    print >> sys.stderr, 'Skipped %d of %d outputs as up to date' % (
+        skipped, skipped + len(jobs))
+
+    # Parallelize over articles; each article is converted serially.
+    pool = process_pool(options)
+    try:
+        if pool is None:
+            # Outputs missing skipped files are converted again next run
+            for path, files, _, o, record in jobs:
+                if convert_corpus_job((path, files, options)):
+                    manifest[o] = record
+        else:
+            import copy
+            serial = copy.copy(options)
+            serial.jobs = 1
+            try:
+                results = pool.imap(convert_corpus_worker,
+                                    [(p, f, serial) for p, f, _, _, _ in jobs])
+                for (_, _, _, o, record), (ok, state) in zip(jobs, results):
+                    merge_worker_state(state)
+                    if ok:
+                        manifest[o] = record
+                pool.close()
+            finally:
+                pool.terminate()
+                pool.join()
+    finally:
+        write_manifest(options.out, manifest)
+    return 0
+
+def make_options(**kwargs):
+    """Return options for the library API from keyword arguments.
+
+    Keywords are the destinations of the command line options (e.g.
+    compact=True, expand_frag=True, limit_id=None), defaults as for the
+    command line.
+    """
+    options = argparser().parse_args([])
+    for key, value in kwargs.items():
+        if not hasattr(options, key) or key == 'file':
+            raise TypeError('unexpected option %s' % key)
+        setattr(options, key, value)
+    return options
+
+def convert_file(job):
+    """Process pool worker: return OA documents for (fn, options)."""
+    fn, options = job
+    return list(iter_converted(fn, options)), take_worker_state()
+
+def iter_oa(files, **options):
+    """Generate OA documents (dicts) converted from Knowtator XML files.
+
+    Files are converted lazily one at a time, or in a process pool with
+    jobs=N, in which case documents are still generated in input order.
+    IDs that failed to map are available from take_unmapped(). Files
+    whose annotation texts do not match are skipped, generating no
+    documents; their mismatches are available from take_mismatches().
+    """
+    options = make_options(**options)
+    if isinstance(files, six.string_types):
+        files = [files]
+    pool = process_pool(options)
+    if pool is None:
+        for fn in files:
+            for document in iter_converted(fn, options):
+                yield document
+    else:
+        try:
+            jobs = ((fn, options) for fn in files)
+            for documents, state in pool.imap(convert_file, jobs):
+                merge_worker_state(state)
+                for document in documents:
+                    yield document
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+
+def convert_files(files, sink, **options):
+    """Pass OA documents converted from files to sink, return count.
+
+    sink is any callable taking one OA document, such as the write
+    method of a JsonLdWriter or a function adding to an index.
+    """
+    n = 0
+    for document in iter_oa(files, **options):
+        sink(document)
+        n += 1
+    return n
+
+class JsonLdWriter(object):
+    """Sink writing OA documents as a JSON-LD graph to out."""
+    def __init__(self, out=None, **options):
+        if out is None:
+            out = sys.stdout
+        self.options = make_options(**options)
+        self.out = BufferedOutput(out)
+        self.separator = document_separator(self.options)
+        self.is_first = True
+        write_header(self.out, self.options)
+
+    def write(self, document):
+        if not self.is_first:
+            self.out.write(self.separator)
+        self.out.write(serialize(document, self.options))
+        self.is_first = False
+
+    __call__ = write
+
+    def close(self):
+        write_footer(self.out, self.options)
+        self.out.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def handle_job(line):
+    """Run one JSON job request, return JSON response (without newline).
+
+    Requests are objects with "files" (list of Knowtator XML paths),
+    optional "options" (keyword arguments as for iter_oa()) and an
+    optional "id" copied to the response. Responses have either
+    "output" (the converted files) or "error", and "warnings" listing
+    IDs that failed to map. Options in serve_run_options are errors.
+    """
+    job_id = None
+    try:
+        job = json.loads(line)
+        job_id = job.get('id')
+        job_options = dict((str(k), v) for k, v in
+                           job.get('options', {}).items())
+        for key in sorted(job_options):
+            if key in serve_run_options:
+                raise ValueError('option %s not supported in jobs' % key)
+        options = make_options(**job_options)
+        out = six.StringIO()
+        process_all(job['files'], options, out)
+        mismatches = take_mismatches()
+        if mismatches:
+            raise TextMismatch([m for ms in mismatches.values() for m in ms])
+        response = {'id': job_id, 'output': out.getvalue()}
+    except Exception, e:
+        take_mismatches()
+        response = {'id': job_id, 'error': '%s: %s' % (type(e).__name__, e)}
+    response['warnings'] = ['failed to map %s (%d times)' % (i, n)
+                            for i, n in sorted(take_unmapped().items())]
+    return json.dumps(response, sort_keys=True)
+
+def serve_stream(inp, out):
+    """Answer job requests read from inp, one JSON object per line."""
+    for line in iter(inp.readline, ''):
+        if not line.strip():
+            continue
+        out.write(handle_job(line) + '\n')
+        out.flush()
+
+def serve_socket(path):
+    """Answer job requests from clients connecting to Unix socket path.
+
+    Connections are handled one at a time, sharing caches across jobs.
+    Return 1 if path exists and is not a socket.
+    """
+    import stat
+    import signal
+    import SocketServer
+
+    class Handler(SocketServer.StreamRequestHandler):
+        def handle(self):
+            serve_stream(self.rfile, self.wfile)
+
+    if os.path.exists(path):
+        if not stat.S_ISSOCK(os.stat(path).st_mode):
+            print >> sys.stderr, '%s: exists and is not a socket' % path
+            return 1
+        os.remove(path)    # stale socket from a previous server
+    # Stop between requests on SIGTERM. (SocketServer catches any
+    # exception raised while handling a request, including SystemExit.)
+    stopped = []
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopped.append(True))
+    server = SocketServer.UnixStreamServer(path, Handler)
+    server.timeout = 0.5
+    try:
+        while not stopped:
+            server.handle_request()
+    finally:
+        server.server_close()
+        os.remove(path)
+    return 0
+
+def request_jobs(path, jobs):
+    """Send jobs (dicts) to the server at Unix socket path.
+
+    Return the response dicts in order.
+    """
+    import socket
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.connect(path)
+    try:
+        stream = client.makefile('rw')
+        responses = exchange_jobs(stream, stream, jobs)
+        stream.close()
+        return responses
+    finally:
+        client.close()
+
+def exchange_jobs(out, inp, jobs):
+    """Write jobs to out and read a response to each from inp.
+
+    Works with the standard input and output of a --serve process.
+    """
+    responses = []
+    for job in jobs:
+        out.write(json.dumps(job) + '\n')
+        out.flush()
+        line = inp.readline()
+        if not line:
+            raise IOError('server closed the connection')
+        responses.append(json.loads(line))
+    return responses
+
+def finish(options):
+    """Write reports and outputs of a run, return 1 if files were skipped."""
+    report_unmapped()
+    skipped = report_mismatches()
+    cache = parse_cache(options)
+    if cache is not None:
+        cache.evict()    # also for runs that only hit the cache
+    if stats is not None:
+        stats.write(options.stats)
+    if span_index is not None:
+        span_index.write(options.span_index)
+    if skipped:
+        print >> sys.stderr, 'Error: skipped %d files with text mismatches' % (
+            skipped)
+        return 1
+    return 0
+
+def check_serve_args(parser, args):
+    """Exit with a parser error for options a server would ignore."""
+    if args.serve and args.serve_socket is not None:
+        parser.error('--serve cannot be combined with --serve-socket')
+    server = '--serve' if args.serve else '--serve-socket'
+    if args.file:
+        parser.error('FILE arguments cannot be combined with %s' % server)
+    for action in parser._actions:
+        if action.dest in serve_process_options or not action.option_strings:
+            continue
+        if getattr(args, action.dest, action.default) != action.default:
+            parser.error('%s cannot be combined with %s; give options in '
+                         'job requests' % ('/'.join(action.option_strings),
+                                           server))
+
+def main(argv):
+    parser = argparser()
+    args = parser.parse_args(argv[1:])
+    text_cache.resize(args.text_cache_size)
+    if args.stats is not None:
+        global stats
+        stats = Stats()
+    if args.span_index is not None:
+        global span_index
+        span_index = SpanIndexBuilder()
+
+    if args.serve or args.serve_socket is not None:
+        check_serve_args(parser, args)
+    if args.serve:
+        serve_stream(sys.stdin, sys.stdout)
+        return 0
+    elif args.serve_socket is not None:
+        try:
+            return serve_socket(args.serve_socket)
+        except KeyboardInterrupt:
+            return 0
+    elif args.corpus is not None:
+        if args.file:
+            parser.error('FILE arguments cannot be combined with --corpus')
+        if args.out is None:
+            parser.error('--corpus requires --out')
+        status = convert_corpus(args)
+        if finish(args):
+            status = 1
+        return status
+    elif not args.file:
+        parser.error('no FILE given')
+
+    if args.shards is not None:
+        if args.merge:
+            parser.error('--merge cannot be combined with --shards')
+        if args.prefetch:
+            parser.error('--prefetch cannot be combined with --shards')
+        write_shards(args.file, args)
+    else:
+        process_all(args.file, args)
+
+    return finish(args)
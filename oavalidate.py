@@ -0,0 +1,290 @@
+#!/usr/bin/env python
+
+"""Validate Open Annotation JSON-LD output of knowtator2oa.py offline."""
+
+import re
+import io
+import sys
+import json
+import multiprocessing
+
+import knowtator2oa as k2oa
+
+OA_ANNOTATION = 'http://www.w3.org/ns/oa#Annotation'
+
+READ_CHUNK_SIZE = 2**16
+
+# Absolute IRI: hierarchical (scheme://...) or URN, no whitespace
+absolute_iri_re = re.compile(r'^(?:[A-Za-z][A-Za-z0-9+.-]*://|urn:)'
+                             r'[^\s<>"{}|\\^`]*$')
+
+ERROR, WARN, PASS = 'error', 'warn', 'pass'
+
+def argparser():
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__)
+
+    parser.add_argument('-j', '--jobs', metavar='N', type=int, default=0,
+                        help='Validate using N processes (0: one per CPU)')
+    parser.add_argument('-v', '--verbose', action='store_true', default=False,
+                        help='Print a message for each error and warning')
+    parser.add_argument('file', metavar='FILE', nargs='+',
+                        help='JSON-LD file (pretty, minified or jsonl)')
+
+    return parser
+
+class JsonStream(object):
+    """Incremental JSON value reader over a file object."""
+
+    def __init__(self, f, chunk_size=READ_CHUNK_SIZE):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = u''
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def fill(self):
+        """Read more input, return False at end of file."""
+        if self.eof:
+            return False
+        # Read at least as much as is buffered to keep refills linear.
+        data = self.f.read(max(self.chunk_size, len(self.buf) - self.pos))
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+        if not data:
+            self.eof = True
+        return bool(data)
+
+    def peek(self):
+        """Return next non-whitespace character, '' at end of input."""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos].isspace():
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                return ''
+
+    def expect(self, chars):
+        c = self.peek()
+        if c == '' or c not in chars:
+            raise ValueError('expected %s, got %r' % (' or '.join(chars), c))
+        self.pos += 1
+        return c
+
+    def value(self):
+        """Decode and return the next JSON value."""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return value
+            except ValueError:
+                if self.eof:
+                    raise
+            # Value may continue past the buffer (e.g. a number).
+            self.fill()
+
+def iter_annotations(f):
+    """Generate (context, annotation) pairs from knowtator2oa.py output.
+
+    Handles one or more {"@context": ..., "@graph": [...]} objects
+    (pretty or minified), streaming over the graph, and jsonl output
+    where a context line precedes one annotation per line.
+    """
+    stream = JsonStream(f)
+    context = {}
+    while stream.peek() != '':
+        start = stream.pos
+        stream.expect('{')
+        if stream.peek() == '}':
+            stream.pos += 1
+            continue
+        key = stream.value()
+        if key != k2oa.oa_context:
+            # Annotation on its own (jsonl)
+            stream.pos = start
+            yield context, stream.value()
+            continue
+        stream.expect(':')
+        context = stream.value()
+        while stream.expect(',}') == ',':
+            key = stream.value()
+            stream.expect(':')
+            if key != '@graph':
+                stream.value()
+                continue
+            stream.expect('[')
+            if stream.peek() == ']':
+                stream.pos += 1
+                continue
+            while True:
+                yield context, stream.value()
+                if stream.expect(',]') == ']':
+                    break
+
+def expand(value, context):
+    """Return term or compact IRI value expanded using JSON-LD context."""
+    term = context.get(value)
+    if isinstance(term, dict):
+        term = term.get('@id')
+    if isinstance(term, basestring) and term != value:
+        return expand(term, context)
+    if ':' in value:
+        prefix, suffix = value.split(':', 1)
+        mapped = context.get(prefix)
+        if isinstance(mapped, basestring) and not suffix.startswith('//'):
+            return expand(mapped, context) + suffix
+    return value
+
+def is_iri(value, context):
+    return (isinstance(value, basestring) and
+            absolute_iri_re.match(expand(value, context)) is not None)
+
+def as_list(value):
+    return value if isinstance(value, list) else [value]
+
+def is_offset(value):
+    return (isinstance(value, (int, long)) and not isinstance(value, bool)
+            and value >= 0)
+
+def target_error(target, context):
+    """Return message if target is not a valid text target, else None."""
+    if isinstance(target, basestring):
+        iri = expand(target, context)
+        if '#' not in iri:
+            return 'target without fragment: %s' % target
+        source, fragment = iri.split('#', 1)
+        m = k2oa.char_fragment_re.match(fragment)
+        if m is None:
+            return 'invalid target fragment: %s' % target
+        if int(m.group(1)) > int(m.group(2)):
+            return 'target start > end: %s' % target
+        if absolute_iri_re.match(source) is None:
+            return 'target source is not an absolute IRI: %s' % target
+        return None
+    elif isinstance(target, dict):
+        source = target.get(k2oa.oa_hasSource)
+        if not is_iri(source, context):
+            return 'target source is not an absolute IRI: %r' % (source, )
+        selector = target.get(k2oa.oa_hasSelector)
+        if not isinstance(selector, dict):
+            return 'target without selector: %r' % (target, )
+        start, end = selector.get(k2oa.oa_start), selector.get(k2oa.oa_end)
+        if not is_offset(start) or not is_offset(end):
+            return 'invalid selector offsets: %r' % (selector, )
+        if start > end:
+            return 'selector start > end: %r' % (selector, )
+        return None
+    else:
+        return 'invalid target: %r' % (target, )
+
+def check_annotation(annotation, context, seen_ids):
+    """Return list of (level, message) results for one annotation."""
+    results = []
+    def check(ok, message, fail_level=ERROR):
+        results.append((PASS, None) if ok else (fail_level, message))
+
+    if not isinstance(annotation, dict):
+        return [(ERROR, 'not an object: %r' % (annotation, ))]
+
+    id_ = annotation.get(k2oa.oa_id)
+    if id_ is None:
+        check(False, 'missing @id')
+    elif not is_iri(id_, context):
+        check(False, '@id is not an absolute IRI: %s' % id_)
+    else:
+        iri = expand(id_, context)
+        check(iri not in seen_ids, 'duplicate @id: %s' % id_)
+        seen_ids.add(iri)
+
+    types = [expand(t, context) if isinstance(t, basestring) else t
+             for t in as_list(annotation.get(k2oa.oa_type, []))]
+    check(OA_ANNOTATION in types, '@type is not oa:Annotation: %r' %
+          (annotation.get(k2oa.oa_type), ))
+
+    if k2oa.oa_hasTarget not in annotation:
+        check(False, 'missing hasTarget')
+    else:
+        targets = as_list(annotation[k2oa.oa_hasTarget])
+        errors = filter(None, (target_error(t, context) for t in targets))
+        check(targets and not errors, '; '.join(errors) or 'empty hasTarget')
+
+    if k2oa.oa_hasBody not in annotation:
+        check(False, 'missing hasBody', WARN)
+    else:
+        bad = [b for b in as_list(annotation[k2oa.oa_hasBody])
+               if not is_iri(b, context)]
+        check(not bad, 'body is not an absolute IRI: %s' %
+              ', '.join(unicode(b) for b in bad))
+
+    if k2oa.oa_annotatedBy not in annotation:
+        check(False, 'missing annotatedBy', WARN)
+    else:
+        annotator = annotation[k2oa.oa_annotatedBy]
+        check(is_iri(annotator, context),
+              'annotatedBy is not an absolute IRI: %r' % (annotator, ))
+
+    return results
+
+def validate_file(fn):
+    """Return (fn, counts, messages) for validating JSON-LD file fn."""
+    counts = dict((level, 0) for level in (ERROR, WARN, PASS))
+    messages = []
+    seen_ids = set()
+    try:
+        with io.open(fn, encoding='utf-8') as f:
+            for context, annotation in iter_annotations(f):
+                for level, message in check_annotation(annotation, context,
+                                                       seen_ids):
+                    counts[level] += 1
+                    if message is not None:
+                        messages.append((level, '%s: %s' % (
+                            annotation.get(k2oa.oa_id)
+                            if isinstance(annotation, dict) else None,
+                            message)))
+    except (IOError, ValueError), e:
+        counts[ERROR] += 1
+        messages.append((ERROR, 'failed to read: %s' % e))
+    return fn, counts, messages
+
+def summary(counts):
+    return 'error: %d, warn: %d, pass: %d, total: %d' % (
+        counts[ERROR], counts[WARN], counts[PASS], sum(counts.values()))
+
+def main(argv):
+    args = argparser().parse_args(argv[1:])
+
+    jobs = min(k2oa.process_pool_size(args), len(args.file))
+    if jobs > 1:
+        pool = multiprocessing.Pool(jobs)
+        results = pool.imap(validate_file, args.file)
+    else:
+        pool = None
+        results = (validate_file(fn) for fn in args.file)
+
+    totals = dict((level, 0) for level in (ERROR, WARN, PASS))
+    try:
+        for fn, counts, messages in results:
+            if args.verbose:
+                for level, message in messages:
+                    print >> sys.stderr, ('%s: %s: %s' % (fn, level, message)
+                                          ).encode('utf-8')
+            print '%s: %s' % (fn, summary(counts))
+            for level in totals:
+                totals[level] += counts[level]
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    if len(args.file) > 1:
+        print 'TOTAL: %s' % summary(totals)
+
+    return 1 if totals[ERROR] else 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
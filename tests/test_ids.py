@@ -0,0 +1,62 @@
+"""Regression tests for annotation IDs against baseline outputs.
+
+data/baseline_ids.json holds the annotation IDs, in output order, that
+the original (json.dumps-hashing) knowtator2oa.py produced for each
+data/examples/craft file with no options, -c, -e and -c -e.
+"""
+
+import os
+import sys
+import json
+import unittest
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(TEST_DIR)
+sys.path.insert(0, ROOT_DIR)
+
+import knowtator2oa
+
+EXAMPLE_DIR = os.path.join(ROOT_DIR, 'data', 'examples', 'craft')
+BASELINE_IDS = os.path.join(TEST_DIR, 'data', 'baseline_ids.json')
+
+# Command line flags of the baseline outputs as library API options
+flag_options = {
+    '': {},
+    '-c': {'compact': True},
+    '-e': {'expand_frag': True},
+    '-c -e': {'compact': True, 'expand_frag': True},
+}
+
+class IdSchemeTest(unittest.TestCase):
+    def setUp(self):
+        with open(BASELINE_IDS) as f:
+            self.baseline = json.load(f)
+
+    def check_scheme(self, scheme):
+        for name, by_flags in sorted(self.baseline.items()):
+            fn = os.path.join(EXAMPLE_DIR, name)
+            for flags, expected in sorted(by_flags.items()):
+                documents = knowtator2oa.iter_oa(fn, id_scheme=scheme,
+                                                 **flag_options[flags])
+                ids = [d[knowtator2oa.oa_id] for d in documents]
+                self.assertEqual(ids, expected, '%s %s %s' % (
+                    scheme, name, flags))
+
+    def test_fast_ids_match_baseline(self):
+        self.check_scheme('fast')
+
+    def test_legacy_ids_match_baseline(self):
+        self.check_scheme('legacy')
+
+    def test_canonical_json_matches_json_dumps(self):
+        document = {
+            '@type': 'oa:Annotation',
+            'hasBody': [u'GO:0005623', u'PPAR\u03b4 "quoted"'],
+            'hasTarget': 'http://example.org/doc.txt#char=1,2',
+        }
+        self.assertEqual(knowtator2oa.canonical_json(document),
+                         json.dumps(document, separators=(',', ':'),
+                                    sort_keys=True))
+
+if __name__ == '__main__':
+    unittest.main()
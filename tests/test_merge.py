@@ -0,0 +1,56 @@
+"""Tests for --merge of annotation layers."""
+
+import os
+import sys
+import glob
+import json
+import unittest
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(TEST_DIR)
+sys.path.insert(0, ROOT_DIR)
+
+import six
+
+import knowtator2oa
+
+EXAMPLES = sorted(glob.glob(os.path.join(ROOT_DIR, 'data', 'examples',
+                                         'craft', '*.knowtator.xml')))
+
+class MergeTest(unittest.TestCase):
+    def merge(self, files):
+        out = six.StringIO()
+        options = knowtator2oa.make_options(merge=True)
+        knowtator2oa.process_all(files, options, out)
+        return json.loads(out.getvalue())['@graph']
+
+    def test_duplicates_dropped(self):
+        a, b = EXAMPLES[:2]
+        self.assertEqual(self.merge([a, b, a]), self.merge([a, b]))
+
+    def test_document_order(self):
+        expected = list(knowtator2oa.iter_oa(EXAMPLES))
+        merged = self.merge(EXAMPLES[::-1])
+        self.assertEqual(sorted(d['@id'] for d in merged),
+                         sorted(d['@id'] for d in expected))
+        keys = [min(knowtator2oa.target_spans(d)) for d in merged]
+        self.assertEqual(keys, sorted(keys))
+
+    def test_stats_per_layer(self):
+        a, b = EXAMPLES[:2]
+        knowtator2oa.stats = knowtator2oa.Stats()
+        try:
+            self.merge([a, b, a])
+            files = knowtator2oa.stats.report()['files']
+        finally:
+            knowtator2oa.stats = None
+        for fn in (a, b):
+            self.assertGreater(files[fn]['time']['convert'], 0)
+            self.assertGreater(files[fn]['time']['output'], 0)
+            self.assertGreater(files[fn]['count']['bytes'], 0)
+        self.assertEqual(files[a]['count']['duplicates'],
+                         files[a]['count']['annotations'] // 2)
+        self.assertNotIn('duplicates', files[b]['count'])
+
+if __name__ == '__main__':
+    unittest.main()
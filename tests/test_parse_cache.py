@@ -0,0 +1,59 @@
+"""Tests for the --parse-cache on-disk cache."""
+
+import os
+import sys
+import glob
+import shutil
+import tempfile
+import unittest
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(TEST_DIR)
+sys.path.insert(0, ROOT_DIR)
+
+import knowtator2oa
+
+EXAMPLES = sorted(glob.glob(os.path.join(ROOT_DIR, 'data', 'examples',
+                                         'craft', '*.knowtator.xml')))
+
+class ParseCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='knowtator2oa-test-')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def entries_size(self):
+        return sum(os.path.getsize(p) for p in
+                   glob.glob(os.path.join(self.directory, '*')))
+
+    def fill(self, max_size):
+        cache = knowtator2oa.ParseCache(self.directory, max_size)
+        for fn in EXAMPLES:
+            cache.store(cache.key(fn), knowtator2oa.parse(fn))
+        return cache
+
+    def test_load_round_trip(self):
+        cache = knowtator2oa.ParseCache(self.directory, 10 ** 9)
+        fn = EXAMPLES[0]
+        parsed = knowtator2oa.parse(fn)
+        cache.store(cache.key(fn), parsed)
+        loaded = cache.load(cache.key(fn))
+        self.assertEqual(knowtator2oa.pack_parsed(loaded),
+                         knowtator2oa.pack_parsed(parsed))
+
+    def test_size_limit(self):
+        size = self.fill(10 ** 9).size
+        self.assertEqual(size, self.entries_size())
+        shutil.rmtree(self.directory)
+        cache = self.fill(size // 2)
+        self.assertLessEqual(self.entries_size(), size // 2)
+        self.assertEqual(cache.size, self.entries_size())
+
+    def test_evicted_on_open(self):
+        self.fill(10 ** 9)
+        knowtator2oa.ParseCache(self.directory, 0)
+        self.assertEqual(self.entries_size(), 0)
+
+if __name__ == '__main__':
+    unittest.main()
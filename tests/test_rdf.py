@@ -0,0 +1,36 @@
+"""Tests for N-Triples term formatting."""
+
+import os
+import sys
+import unittest
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(TEST_DIR)
+sys.path.insert(0, ROOT_DIR)
+
+import knowtator2oa
+
+class RdfTermTest(unittest.TestCase):
+    def test_iri(self):
+        self.assertEqual(knowtator2oa.rdf_term(u'http://example.org/a#b'),
+                         '<http://example.org/a#b>')
+
+    def test_literal_echars(self):
+        self.assertEqual(knowtator2oa.rdf_term(u'a"b\\c\nd\te\r'),
+                         '"a\\"b\\\\c\\nd\\te\\r"')
+
+    def test_literal_bmp(self):
+        self.assertEqual(knowtator2oa.rdf_term(u'PPAR\u03b4\x01'),
+                         '"PPAR\\u03B4\\u0001"')
+
+    def test_literal_non_bmp(self):
+        # A single \U escape, not a pair of \u surrogate escapes
+        self.assertEqual(knowtator2oa.rdf_term(u'\U0001F600 x'),
+                         '"\\U0001F600 x"')
+
+    def test_literal_utf8_str(self):
+        self.assertEqual(knowtator2oa.rdf_term(u'\u03b4'.encode('utf-8')),
+                         '"\\u03B4"')
+
+if __name__ == '__main__':
+    unittest.main()
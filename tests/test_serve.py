@@ -0,0 +1,195 @@
+"""Tests for the --serve and --serve-socket conversion worker."""
+
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import tempfile
+import unittest
+import subprocess
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(TEST_DIR)
+sys.path.insert(0, ROOT_DIR)
+
+import six
+
+import knowtator2oa
+
+SCRIPT = os.path.join(ROOT_DIR, 'knowtator2oa.py')
+EXAMPLE_DIR = os.path.join(ROOT_DIR, 'data', 'examples', 'craft')
+EXAMPLE = '17244351.txt'
+
+# Seconds to wait for the socket server to start listening
+STARTUP_TIMEOUT = 10
+
+def expected_output(fn, **options):
+    out = six.StringIO()
+    knowtator2oa.process_all([fn], knowtator2oa.make_options(**options), out)
+    return out.getvalue()
+
+class ServeTestMixin(object):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='knowtator2oa-test-')
+        for name in (EXAMPLE, EXAMPLE + '.knowtator.xml'):
+            shutil.copy(os.path.join(EXAMPLE_DIR, name), self.directory)
+        self.xml = os.path.join(self.directory, EXAMPLE + '.knowtator.xml')
+        self.start_server()
+
+    def tearDown(self):
+        self.stop_server()
+        shutil.rmtree(self.directory)
+
+    def test_convert(self):
+        responses = self.request([
+            {'id': 1, 'files': [self.xml]},
+            {'id': 2, 'files': [self.xml],
+             'options': {'compact': True, 'expand_frag': True}},
+        ])
+        self.assertEqual([r['id'] for r in responses], [1, 2])
+        self.assertEqual(responses[0]['output'], expected_output(self.xml))
+        self.assertEqual(responses[1]['output'], expected_output(
+            self.xml, compact=True, expand_frag=True))
+        self.assertNotIn('error', responses[0])
+
+    def test_missing_file(self):
+        missing = os.path.join(self.directory, 'missing.knowtator.xml')
+        response, = self.request([{'id': 'm', 'files': [missing]}])
+        self.assertEqual(response['id'], 'm')
+        self.assertIn('IOError', response['error'])
+        self.assertNotIn('output', response)
+
+    def test_malformed_json(self):
+        response, = self.request_raw(['{"files": [\n'])
+        self.assertIn('ValueError', response['error'])
+        # The server keeps answering after an error
+        response, = self.request([{'files': [self.xml]}])
+        self.assertEqual(response['output'], expected_output(self.xml))
+
+    def test_unknown_option(self):
+        response, = self.request([{'files': [self.xml],
+                                   'options': {'bogus': True}}])
+        self.assertIn('unexpected option bogus', response['error'])
+
+    def test_run_option_rejected(self):
+        for key, value in (('stats', 'stats.json'), ('shards', 'shards'),
+                           ('text_cache_size', 10)):
+            response, = self.request([{'files': [self.xml],
+                                       'options': {key: value}}])
+            self.assertIn('option %s not supported' % key, response['error'])
+
+    def test_changed_text_is_reread(self):
+        response, = self.request([{'files': [self.xml]}])
+        self.assertIn('output', response)
+        # Same size, different content: spans no longer match the text
+        text_fn = os.path.join(self.directory, EXAMPLE)
+        with open(text_fn, 'rb') as f:
+            text = f.read()
+        with open(text_fn, 'wb') as f:
+            f.write(text.swapcase())
+        os.utime(text_fn, (time.time() + 10, time.time() + 10))
+        response, = self.request([{'files': [self.xml]}])
+        self.assertIn('mismatch', response['error'])
+
+class ServeStreamTest(ServeTestMixin, unittest.TestCase):
+    def start_server(self):
+        self.server = subprocess.Popen([sys.executable, SCRIPT, '--serve'],
+                                       stdin=subprocess.PIPE,
+                                       stdout=subprocess.PIPE,
+                                       stderr=open(os.devnull, 'w'))
+
+    def stop_server(self):
+        self.server.stdin.close()
+        self.assertEqual(self.server.wait(), 0)
+
+    def request(self, jobs):
+        return knowtator2oa.exchange_jobs(self.server.stdin,
+                                          self.server.stdout, jobs)
+
+    def request_raw(self, lines):
+        responses = []
+        for line in lines:
+            self.server.stdin.write(line)
+            self.server.stdin.flush()
+            responses.append(json.loads(self.server.stdout.readline()))
+        return responses
+
+class ServeSocketTest(ServeTestMixin, unittest.TestCase):
+    def start_server(self):
+        self.path = os.path.join(self.directory, 'server.sock')
+        self.server = subprocess.Popen([sys.executable, SCRIPT,
+                                        '--serve-socket', self.path],
+                                       stderr=open(os.devnull, 'w'))
+        deadline = time.time() + STARTUP_TIMEOUT
+        while True:
+            self.assertIsNone(self.server.poll())
+            self.assertLess(time.time(), deadline)
+            client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                client.connect(self.path)
+                break
+            except socket.error:
+                time.sleep(0.01)
+            finally:
+                client.close()
+
+    def stop_server(self):
+        self.server.terminate()
+        self.assertEqual(self.server.wait(), 0)
+        self.assertFalse(os.path.exists(self.path))
+
+    def request(self, jobs):
+        return knowtator2oa.request_jobs(self.path, jobs)
+
+    def request_raw(self, lines):
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        client.connect(self.path)
+        try:
+            stream = client.makefile('rw')
+            responses = []
+            for line in lines:
+                stream.write(line)
+                stream.flush()
+                responses.append(json.loads(stream.readline()))
+            stream.close()
+            return responses
+        finally:
+            client.close()
+
+    def test_refuses_to_replace_regular_file(self):
+        path = os.path.join(self.directory, 'not-a-socket')
+        with open(path, 'w') as f:
+            f.write('data')
+        status = subprocess.call([sys.executable, SCRIPT,
+                                  '--serve-socket', path],
+                                 stderr=open(os.devnull, 'w'))
+        self.assertEqual(status, 1)
+        with open(path) as f:
+            self.assertEqual(f.read(), 'data')
+
+class ServeArgsTest(unittest.TestCase):
+    def test_run_options_rejected(self):
+        directory = tempfile.mkdtemp(prefix='knowtator2oa-test-')
+        try:
+            stats_fn = os.path.join(directory, 'stats.json')
+            socket_fn = os.path.join(directory, 'server.sock')
+            for args in (['--serve', '--stats', stats_fn],
+                         ['--serve', '--span-index', stats_fn],
+                         ['--serve', '-c'],
+                         ['--serve', '--serve-socket', socket_fn],
+                         ['--serve-socket', socket_fn, '--shards', directory],
+                         ['--serve-socket', socket_fn, '--corpus', directory]):
+                process = subprocess.Popen([sys.executable, SCRIPT] + args,
+                                           stdin=subprocess.PIPE,
+                                           stderr=subprocess.PIPE)
+                _, err = process.communicate('')
+                self.assertEqual(process.returncode, 2, args)
+                self.assertIn('cannot be combined', err)
+            self.assertEqual(os.listdir(directory), [])
+        finally:
+            shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+"""Tests for --shards gzip-compressed output."""
+
+import os
+import sys
+import glob
+import gzip
+import json
+import shutil
+import tempfile
+import unittest
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(TEST_DIR)
+sys.path.insert(0, ROOT_DIR)
+
+import knowtator2oa
+
+EXAMPLES = sorted(glob.glob(os.path.join(ROOT_DIR, 'data', 'examples',
+                                         'craft', '*.knowtator.xml')))
+
+class ShardTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='knowtator2oa-test-')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write_shards(self, **options):
+        options = knowtator2oa.make_options(shards=self.directory, **options)
+        knowtator2oa.write_shards(EXAMPLES, options)
+        with open(os.path.join(self.directory,
+                               knowtator2oa.SHARD_INDEX_FILE)) as f:
+            return json.load(f)
+
+    def shard_graphs(self, index):
+        graphs = []
+        for name in index['shards']:
+            with gzip.open(os.path.join(self.directory, name)) as f:
+                graphs.append(json.load(f)['@graph'])
+        return graphs
+
+    def test_annotation_limit_splits_files(self):
+        index = self.write_shards(shard_annotations=50)
+        graphs = self.shard_graphs(index)
+        expected = list(knowtator2oa.iter_oa(EXAMPLES))
+        self.assertEqual([len(g) for g in graphs[:-1]],
+                         [50] * (len(graphs) - 1))
+        self.assertEqual([d for g in graphs for d in g], expected)
+        # Some input files have annotations in more than one shard
+        self.assertTrue(any(len(set(e[0] for e in entries)) > 1
+                            for entries in index['documents'].values()))
+        documents = []
+        for doc_id in sorted(index['documents']):
+            documents.extend(knowtator2oa.read_shard_document(self.directory,
+                                                              doc_id))
+        self.assertEqual(sorted(d['@id'] for d in documents),
+                         sorted(d['@id'] for d in expected))
+
+    def test_unlimited(self):
+        graphs = self.shard_graphs(self.write_shards())
+        self.assertEqual(graphs, [list(knowtator2oa.iter_oa(EXAMPLES))])
+
+if __name__ == '__main__':
+    unittest.main()
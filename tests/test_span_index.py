@@ -0,0 +1,109 @@
+"""Tests for --span-index files against a brute-force scan."""
+
+import os
+import sys
+import glob
+import random
+import shutil
+import tempfile
+import unittest
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(TEST_DIR)
+sys.path.insert(0, ROOT_DIR)
+
+import knowtator2oa
+
+EXAMPLES = sorted(glob.glob(os.path.join(ROOT_DIR, 'data', 'examples',
+                                         'craft', '*.knowtator.xml')))
+
+# Command line flags as library API options
+flag_options = {
+    '': {},
+    '-c': {'compact': True},
+    '-e': {'expand_frag': True},
+    '-c -e': {'compact': True, 'expand_frag': True},
+}
+
+MODES = {
+    'overlap': lambda s, e, start, end: s < end and e > start,
+    'within': lambda s, e, start, end: s >= start and e <= end,
+    'covers': lambda s, e, start, end: s <= start and e >= end,
+}
+
+# Random queries per document and mode, in addition to span boundaries
+RANDOM_QUERIES = 100
+
+def brute_force(annotations, spans, mode, start, end):
+    """Return [ID, body] of annotations matching as SpanIndex.query()."""
+    found, seen = [], set()
+    for s, e, i in sorted(spans):
+        if MODES[mode](s, e, start, end) and i not in seen:
+            seen.add(i)
+            found.append(annotations[i])
+    return found
+
+class SpanIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='knowtator2oa-test-')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def build(self, flags):
+        builder = knowtator2oa.SpanIndexBuilder()
+        for document in knowtator2oa.iter_oa(EXAMPLES, **flag_options[flags]):
+            builder.add(document)
+        fn = os.path.join(self.directory, 'index' + flags.replace(' ', ''))
+        builder.write(fn)
+        return builder, fn
+
+    def queries(self, spans, rng):
+        ends = [e for _, e, _ in spans]
+        points = sorted(set([0, max(ends) + 1] +
+                            [s for s, _, _ in spans] + ends))
+        for s, e, _ in spans:
+            yield s, e
+            yield s, s
+            yield e - 1, e + 1
+        for _ in range(RANDOM_QUERIES):
+            start = rng.choice(points) + rng.randint(-2, 2)
+            yield start, start + rng.choice([0, 1, 5, 50, 500, 50000])
+
+    def check_flags(self, flags):
+        builder, fn = self.build(flags)
+        rng = random.Random(1)
+        with knowtator2oa.SpanIndex(fn) as index:
+            for source, spans in builder.spans.items():
+                for start, end in self.queries(spans, rng):
+                    for mode in sorted(MODES):
+                        self.assertEqual(
+                            index.query(source, start, end, mode),
+                            brute_force(builder.annotations, spans, mode,
+                                        start, end),
+                            '%s %s %s %d %d' % (flags, source, mode, start,
+                                                end))
+            self.assertEqual(index.query('missing', 0, 10), [])
+            self.assertRaises(ValueError, index.query, source, 0, 1, 'bogus')
+
+    def test_no_flags(self):
+        self.check_flags('')
+
+    def test_compact(self):
+        self.check_flags('-c')
+
+    def test_expand_frag(self):
+        self.check_flags('-e')
+
+    def test_compact_expand_frag(self):
+        self.check_flags('-c -e')
+
+    def test_compact_source_lookup(self):
+        builder, fn = self.build('-c')
+        full, _ = self.build('')
+        with knowtator2oa.SpanIndex(fn) as index:
+            for source in full.spans:
+                self.assertTrue(index.query(source, 0, 10 ** 6))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+"""Tests for the streaming reader (-s) against non-streaming conversion."""
+
+import os
+import sys
+import glob
+import json
+import random
+import shutil
+import tempfile
+import unittest
+import xml.etree.ElementTree as ET
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(TEST_DIR)
+sys.path.insert(0, ROOT_DIR)
+
+import knowtator2oa
+
+EXAMPLE_DIR = os.path.join(ROOT_DIR, 'data', 'examples', 'craft')
+EXAMPLES = sorted(glob.glob(os.path.join(EXAMPLE_DIR, '*.knowtator.xml')))
+
+# Examples with slot mentions (e.g. complexSlotMention)
+SLOT_EXAMPLES = ['15328533.txt', '15588329.txt', '15938754.txt']
+
+def canonical(documents):
+    return sorted(json.dumps(d, sort_keys=True) for d in documents)
+
+class StreamTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='knowtator2oa-test-')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def reordered(self, name, order):
+        """Return path of a copy of example name with elements reordered."""
+        shutil.copy(os.path.join(EXAMPLE_DIR, name), self.directory)
+        tree = ET.parse(os.path.join(EXAMPLE_DIR, name + '.knowtator.xml'))
+        root = tree.getroot()
+        elements = list(root)
+        for e in elements:
+            root.remove(e)
+        root.extend(order(elements))
+        fn = os.path.join(self.directory, name + '.knowtator.xml')
+        tree.write(fn, encoding='UTF-8')
+        return fn
+
+    def check_same(self, fn, **options):
+        expected = list(knowtator2oa.iter_oa([fn], **options))
+        streamed = list(knowtator2oa.iter_oa([fn], stream=True, **options))
+        self.assertEqual(canonical(streamed), canonical(expected))
+        self.assertEqual(sorted(d['@id'] for d in streamed),
+                         sorted(d['@id'] for d in expected))
+        return expected
+
+    def test_examples(self):
+        for fn in EXAMPLES:
+            for options in ({}, {'compact': True, 'expand_frag': True}):
+                self.check_same(fn, **options)
+
+    def check_order(self, order):
+        for name in SLOT_EXAMPLES:
+            original = list(knowtator2oa.iter_oa(
+                [os.path.join(EXAMPLE_DIR, name + '.knowtator.xml')]))
+            expected = self.check_same(self.reordered(name, order))
+            self.assertEqual(canonical(expected), canonical(original))
+
+    def test_slots_after_mentions(self):
+        slot_tags = (knowtator2oa.t_boolslot, knowtator2oa.t_intslot,
+                     knowtator2oa.t_strslot, knowtator2oa.t_cmpxslot)
+        self.check_order(lambda elements: (
+            [e for e in elements if e.tag not in slot_tags] +
+            [e for e in elements if e.tag in slot_tags]))
+
+    def test_slots_before_mentions(self):
+        self.check_order(lambda elements: elements[::-1])
+
+    def test_shuffled(self):
+        rng = random.Random(1)
+        def shuffled(elements):
+            elements = list(elements)
+            rng.shuffle(elements)
+            return elements
+        self.check_order(shuffled)
+
+if __name__ == '__main__':
+    unittest.main()
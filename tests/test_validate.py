@@ -0,0 +1,73 @@
+"""Tests for span validation of input files against their texts."""
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(TEST_DIR)
+sys.path.insert(0, ROOT_DIR)
+
+import six
+
+import knowtator2oa
+
+EXAMPLE_DIR = os.path.join(ROOT_DIR, 'data', 'examples', 'craft')
+GOOD, BAD = '11532192.txt', '15588329.txt'
+
+class MismatchTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='knowtator2oa-test-')
+        for name in (GOOD, BAD):
+            for fn in (name, name + '.knowtator.xml'):
+                shutil.copy(os.path.join(EXAMPLE_DIR, fn), self.directory)
+        # Same length, different case: every annotation text mismatches
+        text_fn = os.path.join(self.directory, BAD)
+        with open(text_fn, 'rb') as f:
+            text = f.read()
+        with open(text_fn, 'wb') as f:
+            f.write(text.swapcase())
+        self.good = os.path.join(self.directory, GOOD + '.knowtator.xml')
+        self.bad = os.path.join(self.directory, BAD + '.knowtator.xml')
+        knowtator2oa.take_mismatches()
+
+    def tearDown(self):
+        knowtator2oa.take_mismatches()
+        shutil.rmtree(self.directory)
+
+    def check_skipped(self, **options):
+        expected = list(knowtator2oa.iter_oa([self.good], **options))
+        documents = list(knowtator2oa.iter_oa([self.bad, self.good, self.bad],
+                                              **options))
+        self.assertEqual(documents, expected)
+        mismatches = knowtator2oa.take_mismatches()
+        self.assertEqual(list(mismatches), [self.bad])
+        self.assertEqual(len(mismatches[self.bad]), 24)
+
+    def test_skipped(self):
+        self.check_skipped()
+
+    def test_skipped_stream(self):
+        self.check_skipped(stream=True)
+
+    def test_skipped_merge_layer(self):
+        out = six.StringIO()
+        options = knowtator2oa.make_options(merge=True)
+        knowtator2oa.process_all([self.bad, self.good], options, out)
+        expected = six.StringIO()
+        knowtator2oa.process_all([self.good], options, expected)
+        self.assertEqual(out.getvalue(), expected.getvalue())
+        self.assertEqual(list(knowtator2oa.take_mismatches()), [self.bad])
+
+    def test_report(self):
+        list(knowtator2oa.iter_oa([self.bad, self.good]))
+        out = six.StringIO()
+        self.assertEqual(knowtator2oa.report_mismatches(out), 1)
+        self.assertIn('skipped %s: 24 text mismatches' % self.bad,
+                      out.getvalue())
+        self.assertEqual(knowtator2oa.report_mismatches(out), 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,17 +1,20 @@
 #!/bin/bash
 
+# Convert example data and validate the output offline with oavalidate.py.
+# (lsvalidate.sh validates single files using the lorestore service.)
+
 set -e
 set -u
 
+tmpdir=`mktemp -d validate-all-tmp-XXX`
+trap 'rm -rf "$tmpdir"' EXIT
+
 for f in data/examples/craft/*.xml; do
     echo "Process $f"
-    o=`basename $f .xml`.json
-    ./knowtator2oa.py "$f" > "$o"
-    ./lsvalidate.sh "$o"
-    rm "$o"
+    o="$tmpdir/"`basename $f .xml`
+    ./knowtator2oa.py "$f" > "$o.json"
     echo "Process $f, compact"
-    ./knowtator2oa.py -c "$f" > "$o"
-    ./lsvalidate.sh "$o"
-    rm "$o"
-    echo
-done
\ No newline at end of file
+    ./knowtator2oa.py -c "$f" > "$o.compact.json"
+done
+
+./oavalidate.py "$tmpdir"/*.json